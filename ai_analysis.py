@@ -0,0 +1,316 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import history_store
+import response_cache
+import instrumentation
+
+# =====================
+# AI分析設定
+# =====================
+MODEL = "llama-3.1-8b-instant"
+PROMPT_VERSION = 3          # プロンプトや分割方法を変えたら上げる（キャッシュが無効になる）
+CHUNK_TOKEN_BUDGET = 6000   # 1回のリクエストに載せるメモの目安トークン数
+MAX_CONCURRENCY = 3         # 同時に投げるリクエスト数（プロセス内のすべてのスレッドの合計）
+MAX_RETRIES = 5
+RETRY_BASE_SEC = 2
+
+TOKEN_ERROR_MSG = "⚠️ データ量が多すぎてTOKENが足りません（API制限）。\n期間を絞ってください。"
+
+REPORT_PROMPT = """
+        あなたはデータアナリストです。
+        対象期間: 【{period_label}】
+        以下の電話メモデータを分析し、日本語でレポートを作成してください。
+
+        【指示】
+        - 「明日」「今日」「電話」「お願いします」などの一般的な単語は分析対象から外してください。
+        - 業務上の具体的な課題や、頻出する固有名詞に着目してください。
+
+        【フォーマット】
+        1. 頻出トピック (3つ)
+        2. 傾向の要約 (200文字以内)
+        3. 業務改善アドバイス
+
+        [データ]
+        {data}
+        """
+
+MAP_PROMPT = """
+        あなたはデータアナリストです。
+        対象期間: 【{period_label}】（全データのうち {part}/{total} 番目の分割）
+        以下の電話メモを読み、後で他の分割と統合するための中間メモを日本語で作成してください。
+
+        【指示】
+        - 「明日」「今日」「電話」「お願いします」などの一般的な単語は除外してください。
+        - 頻出トピックとおおよその件数、目立つ固有名詞、業務上の課題を箇条書きで300文字以内にまとめてください。
+
+        [データ]
+        {data}
+        """
+
+REDUCE_PROMPT = """
+        あなたはデータアナリストです。
+        対象期間: 【{period_label}】
+        以下は電話メモを分割して分析した中間メモです。全体を統合し、日本語でレポートを作成してください。
+
+        【フォーマット】
+        1. 頻出トピック (3つ)
+        2. 傾向の要約 (200文字以内)
+        3. 業務改善アドバイス
+
+        [中間メモ]
+        {data}
+        """
+
+ROLLUP_PROMPT = """
+        あなたはデータアナリストです。
+        対象: 【{scope}】
+        以下は電話メモを分割・期間別に分析した中間メモです。これらを1つの中間メモに統合してください。
+
+        【指示】
+        - 頻出トピックとおおよその件数、目立つ固有名詞、業務上の課題を箇条書きで300文字以内にまとめてください。
+
+        [中間メモ]
+        {data}
+        """
+
+
+_clients = {}  # api_key -> Client（HTTP接続を使い回すため、キーごとにプロセスで1つ）
+_clients_lock = threading.Lock()
+
+
+def make_client(api_key):
+    # groq は最初の分析のときに読み込む
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            from groq import Client
+            client = _clients[api_key] = Client(api_key=api_key)
+        return client
+
+
+# =====================
+# 分割
+# =====================
+def estimate_tokens(text):
+    # 日本語は1文字≒1トークン、英数字は4文字≒1トークンとして概算
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def split_memos(memo_list, budget=CHUNK_TOKEN_BUDGET):
+    # メモを順番に詰めて、1バッチが budget を超えないように分ける
+    chunks, current, used = [], [], 0
+    for memo in memo_list:
+        memo = str(memo)
+        cost = estimate_tokens(memo) + 1
+        if cost > budget:
+            memo = memo[:budget]  # 1件で予算を超える長文は切り詰める
+            cost = estimate_tokens(memo) + 1
+        if current and used + cost > budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(memo)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# =====================
+# レート制限を考慮したリクエスト
+# =====================
+class RateLimiter:
+    # 429 を受けたら retry-after の間、全スレッドのリクエストを止める
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pause_until = 0.0
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self._pause_until - time.time()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._pause_until = max(self._pause_until, time.time() + seconds)
+
+
+_limiter = RateLimiter()
+# 同時リクエスト数の上限は complete() の中だけで守る
+# （_map の中からさらに _map を呼んでスレッドが増えても、API に同時に投げるのは MAX_CONCURRENCY 件まで）
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+
+def is_rate_limit_error(e):
+    err_msg = str(e)
+    return getattr(e, "status_code", None) == 429 or "rate_limit_exceeded" in err_msg or "429" in err_msg
+
+
+def _retry_after(e, attempt):
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return RETRY_BASE_SEC * 2 ** attempt
+
+
+def complete(client, prompt, temperature, max_tokens, limiter=_limiter):
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.wait()
+        try:
+            with _request_slots, instrumentation.timed("groq.request"):
+                completion = client.chat.completions.create(
+                    model=MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=temperature, max_tokens=max_tokens
+                )
+            instrumentation.add("groq.requests")
+            usage = getattr(completion, "usage", None)
+            if usage is not None:
+                instrumentation.add("groq.prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+                instrumentation.add("groq.completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
+            return completion.choices[0].message.content
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == MAX_RETRIES:
+                instrumentation.add("groq.errors")
+                raise
+            instrumentation.add("groq.rate_limited")
+            limiter.pause(_retry_after(e, attempt))
+
+
+def _map(fn, items):
+    if len(items) == 1:
+        return [fn(items[0])]
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as pool:
+        return list(pool.map(fn, items))
+
+
+# =====================
+# 総合レポート（分割 → 並列分析 → 統合）
+# =====================
+def _rollup(client, notes, scope):
+    # 中間メモを1つになるまで段階的に統合
+    while len(notes) > 1:
+        notes = _map(lambda g: complete(client, ROLLUP_PROMPT.format(scope=scope, data="\n\n".join(g)), 0.3, 600),
+                     split_memos(notes))
+    return notes[0]
+
+
+def _reduce(client, partials, period_label):
+    # 中間メモから最終レポートを作る（1リクエストに収まらなければ先に統合）
+    if len(split_memos(partials)) > 1:
+        partials = [_rollup(client, partials, period_label)]
+    return complete(client, REDUCE_PROMPT.format(period_label=period_label, data="\n\n".join(partials)), 0.5, 1000)
+
+
+def _map_chunks(client, chunks, scope):
+    return _map(
+        lambda ic: complete(client, MAP_PROMPT.format(period_label=scope, part=ic[0] + 1, total=len(chunks),
+                                                      data="\n".join(ic[1])), 0.3, 600),
+        list(enumerate(chunks))
+    )
+
+
+def summarize_memos(client, memo_list, scope):
+    # メモ群を1つの中間メモにまとめる（月別サマリー用）
+    return _rollup(client, _map_chunks(client, split_memos(memo_list) or [[]], scope), scope)
+
+
+def analyze_memos(client, memo_list, period_label):
+    chunks = split_memos(memo_list)
+    if len(chunks) <= 1:
+        return complete(client, REPORT_PROMPT.format(period_label=period_label, data="\n".join(chunks[0] if chunks else [])), 0.5, 1000)
+    return _reduce(client, _map_chunks(client, chunks, period_label), period_label)
+
+
+# =====================
+# 月別サマリーと階層集約（月 → 年 → 全期間）
+# =====================
+# 月ごとの中間メモを、その月のメモのハッシュと一緒に保存しておく（response_cache の SQLite）。
+# メモが変わらない（締まった）月は二度と再計算せず、年・全期間のレポートは
+# 保存済みサマリーを統合する小さなリクエストだけで作る。
+def month_summary(client, month, memo_list):
+    memo_hash = response_cache.memo_hash(memo_list)
+    ent = response_cache.get_month_summary(month)
+    if ent and ent["hash"] == memo_hash and ent["version"] == PROMPT_VERSION:
+        return ent["summary"]
+    summary = summarize_memos(client, memo_list, month)
+    response_cache.put_month_summary(month, {"hash": memo_hash, "version": PROMPT_VERSION, "summary": summary})
+    return summary
+
+
+def year_summary(client, year, month_summaries):
+    # 年サマリーは月サマリーの内容で決まるので、応答キャッシュに載せる
+    key = response_cache.make_key("year_summary", MODEL, PROMPT_VERSION, year, month_summaries)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    summary = _rollup(client, list(month_summaries), f"{year}年")
+    response_cache.put(key, summary)
+    return summary
+
+
+MEMO_COLUMNS = ("日時", "相手", "詳細")  # TAB3 と同じ列（月ごとの読み込みキャッシュを共用する）
+
+
+def group_memos_by_month(partitions):
+    # 月キー（"YYYY-MM"）のリストから {"YYYY-MM": [メモ, ...]} を作る
+    # 月は日時を1行ずつ整形せずパーティションのキーを使い、月の中は TAB3 と同じく新しい順に並べる
+    memos = {}
+    for k in partitions:
+        _, df = history_store.load_partition(k, MEMO_COLUMNS)
+        df = df.dropna(subset=["datetime", "詳細"]).sort_values("datetime", ascending=False, kind="stable")
+        if len(df):
+            memos[k] = df["詳細"].tolist()
+    return memos
+
+
+def _flatten(memos_by_month):
+    # TAB3 の並び（新しい月が先）と同じ順でメモを並べる
+    return [m for k in sorted(memos_by_month, reverse=True) for m in memos_by_month[k]]
+
+
+def analyze_period(client, memos_by_month, period_label):
+    months = sorted(memos_by_month)
+    if len(months) <= 1:
+        return analyze_memos(client, _flatten(memos_by_month), period_label)
+    summaries = dict(zip(months, _map(lambda k: month_summary(client, k, memos_by_month[k]), months)))
+    years = sorted({k[:4] for k in months})
+    if len(years) == 1:
+        partials = [f"【{k}】\n{summaries[k]}" for k in months]
+    else:
+        partials = [
+            f"【{y}年】\n" + year_summary(client, y, [summaries[k] for k in months if k.startswith(y)])
+            for y in years
+        ]
+    return _reduce(client, partials, period_label)
+
+
+def cached_report(memos_by_month, period_label):
+    # APIを呼ばずにキャッシュだけを見る（なければ None）
+    return response_cache.get(response_cache.make_key("analyze", MODEL, PROMPT_VERSION, period_label, _flatten(memos_by_month)))
+
+
+def analyze_with_groq(api_key, memos_by_month, period_label, client=None):
+    # memos_by_month: {"YYYY-MM": [メモ, ...]}（list を渡した場合は1つの月として扱う）
+    if client is None and not api_key: return "⚠️ Groq APIキーを設定してください"
+    if not isinstance(memos_by_month, dict):
+        memos_by_month = {period_label: list(memos_by_month)}
+    key = response_cache.make_key("analyze", MODEL, PROMPT_VERSION, period_label, _flatten(memos_by_month))
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        report = analyze_period(client or make_client(api_key), memos_by_month, period_label)
+        response_cache.put(key, report)  # エラー文は保存しない
+        return report
+    except Exception as e:
+        err_msg = str(e)
+        if is_rate_limit_error(e) or "413" in err_msg:
+            return TOKEN_ERROR_MSG
+        return f"エラー: {e}"
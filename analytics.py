@@ -0,0 +1,96 @@
+import threading
+import numpy as np
+import pandas as pd
+
+import history_store
+import instrumentation
+
+# =====================
+# 時系列の集計（曜日×時間帯・担当者別・折り返し依頼の推移）
+# =====================
+# 日時 / To / 用件 の3列だけを読み（To と 用件 は読み込み時からカテゴリ型）、月の組み合わせごとに保持する。
+# 集計はすべて bincount / groupby / resample で行い、1行ずつのループは使わない。
+WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+CALLBACK_REQUEST = "折り返しのお願い"
+FRAME_CACHE_SIZE = 8
+HOUR_BINS = 3  # PDF の表は3時間ごとにまとめる（24列は A4 に収まらないため）
+
+_lock = threading.Lock()
+_frame_cache = {}  # partitions -> {"fps", "df"}
+
+
+@instrumentation.timed("analytics.frame")
+def analytics_frame(partitions=None):
+    # 指定した月の (datetime, To, 用件) を返す。どの月の指紋も変わっていなければ前回のものを使う
+    store = history_store.get_store()
+    keys = store.partitions() if partitions is None else [k for k in store.partitions() if k in set(partitions)]
+    cache_key = tuple(keys)
+    fps = tuple(store.fingerprint(k) for k in keys)
+    with _lock:
+        ent = _frame_cache.get(cache_key)
+        if ent is not None and ent["fps"] == fps:
+            return ent["df"]
+    df = history_store.safe_load_history(["日時", "To", "用件"], keys).dropna(subset=["datetime"])
+    df = df[["datetime", "To", "用件"]].sort_values("datetime", kind="stable").reset_index(drop=True)
+    with _lock:
+        _frame_cache.pop(cache_key, None)
+        _frame_cache[cache_key] = {"fps": fps, "df": df}
+        while len(_frame_cache) > FRAME_CACHE_SIZE:
+            _frame_cache.pop(next(iter(_frame_cache)))
+    return df
+
+
+def weekday_hour_heatmap(df):
+    # 行: 曜日（月〜日）、列: 時（0〜23）の件数
+    dt = df["datetime"].dt
+    counts = np.bincount(dt.dayofweek.to_numpy() * 24 + dt.hour.to_numpy(), minlength=7 * 24)
+    return pd.DataFrame(counts.reshape(7, 24), index=WEEKDAYS, columns=range(24))
+
+
+def heatmap_by_hour_bins(heatmap, width=HOUR_BINS):
+    # 列を width 時間ごとにまとめる（例: "0-2時"）
+    binned = heatmap.T.groupby(np.arange(24) // width).sum().T
+    binned.columns = [f"{b * width}-{b * width + width - 1}時" for b in binned.columns]
+    return binned
+
+
+def staff_load(df):
+    # 担当者（To）別の件数・折り返し依頼の件数・全体に占める割合（件数の多い順）
+    is_callback = (df["用件"] == CALLBACK_REQUEST).to_numpy()
+    grouped = pd.DataFrame({"To": df["To"], "折り返し": is_callback}).groupby("To", observed=True)["折り返し"]
+    load = pd.DataFrame({"件数": grouped.size(), "折り返し": grouped.sum().astype(int)})
+    load = load[load.index != ""]
+    load["割合"] = (load["件数"] / max(len(df), 1)).round(3)
+    return load.sort_values("件数", ascending=False, kind="stable")
+
+
+def trend_freq(df):
+    # 期間の長さに合わせた集計単位（1か月以内は日、半年以内は週、それ以上は月）
+    if df.empty:
+        return "D"
+    span = df["datetime"].iloc[-1] - df["datetime"].iloc[0]
+    return "D" if span <= pd.Timedelta(days=31) else "W-MON" if span <= pd.Timedelta(days=183) else "MS"
+
+
+def callback_trend(df, freq=None):
+    # 期間ごとの全件数・折り返し依頼の件数・その割合と、折り返し依頼の累計
+    # （折り返しが済んだかどうかは記録していないので、依頼の件数の推移として見る）
+    freq = freq or trend_freq(df)
+    s = pd.DataFrame({"全件": 1, "折り返し": (df["用件"] == CALLBACK_REQUEST).astype(int).to_numpy()},
+                     index=pd.DatetimeIndex(df["datetime"]))
+    trend = s.resample(freq).sum()
+    trend["割合"] = (trend["折り返し"] / trend["全件"].where(trend["全件"] > 0)).fillna(0).round(3)
+    trend["折り返し累計"] = trend["折り返し"].cumsum()
+    return trend
+
+
+@instrumentation.timed("analytics.summary")
+def summarize(partitions=None):
+    # 画面と PDF で使う集計をまとめて返す
+    df = analytics_frame(partitions)
+    return {
+        "rows": len(df),
+        "heatmap": weekday_hour_heatmap(df),
+        "staff": staff_load(df),
+        "callback": callback_trend(df),
+    }
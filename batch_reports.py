@@ -0,0 +1,122 @@
+import os
+import re
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import history_store
+import write_queue
+import ai_analysis
+import keywords
+import pdf_report
+import analytics
+
+# =====================
+# 設定
+# =====================
+# 使い方:
+#   python batch_reports.py                         全ての月のレポートを reports/ に出力
+#   python batch_reports.py --by year --ai          年ごと、AI分析つき（GROQ_API_KEY が必要）
+#   python batch_reports.py --start 2024-01 --end 2024-12 --workers 4
+OUT_DIR = "reports"
+MANIFEST_NAME = "_manifest.json"
+NO_AI_TEXT = "（AI分析は未実行です。--ai を付けて実行するか、アプリでレポートを生成してください）"
+
+
+def list_periods(by, start=None, end=None):
+    # [(期間ラベル, [月キー, ...]), ...] を新しい順で返す
+    months = sorted(
+        (k for k, info in history_store.partition_index().items()
+         if re.match(r"^\d{4}-\d{2}$", k) and info["rows"] > 0
+         and (start is None or k >= start) and (end is None or k <= end)),
+        reverse=True
+    )
+    if by == "all":
+        return [("全期間", months)] if months else []
+    if by == "year":
+        years = sorted({k[:4] for k in months}, reverse=True)
+        return [(f"{y}年 年間", [k for k in months if k.startswith(y)]) for y in years]
+    return [(f"{int(k[:4])}年 {int(k[5:])}月", [k]) for k in months]
+
+
+def input_fingerprint(keys, with_ai):
+    # 元データの指紋（＋分析設定）が前回と同じなら作り直さない
+    store = history_store.get_store()
+    return json.dumps([[k, store.fingerprint(k)] for k in keys] + [ai_analysis.PROMPT_VERSION, with_ai])
+
+
+def build_report(label, keys, with_ai, api_key, out_dir):
+    df = history_store.safe_load_history(["日時", "相手", "詳細"], keys).dropna(subset=["datetime"])
+    if df.empty:
+        return label, None, False
+    caller_series = history_store.rollup_counts("相手", keys)
+    kw_df = keywords.extract_keywords(df["詳細"])
+    memos_by_month = ai_analysis.group_memos_by_month(keys)
+    report = ai_analysis.cached_report(memos_by_month, label)
+    if report is None and with_ai:
+        report = ai_analysis.analyze_with_groq(api_key, memos_by_month, label)
+    # エラー文や未実行のレポートは、次回の実行で作り直す
+    complete = report is not None and "TOKENが足りません" not in report and not report.startswith(("エラー", "⚠️"))
+    if report is None:
+        report = NO_AI_TEXT
+    base = os.path.join(out_dir, f"report_{label.replace(' ', '_')}")
+    with open(base + ".pdf", "wb") as f:
+        f.write(pdf_report.render_pdf(report, label, caller_series, kw_df, analytics.summarize(keys)))
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        f.write(report)
+    return label, base + ".pdf", complete
+
+
+def main():
+    parser = argparse.ArgumentParser(description="期間ごとの分析レポート(PDF)を一括作成")
+    parser.add_argument("--by", choices=["month", "year", "all"], default="month", help="レポートの単位")
+    parser.add_argument("--start", help="対象の開始月 (YYYY-MM)")
+    parser.add_argument("--end", help="対象の終了月 (YYYY-MM)")
+    parser.add_argument("--out", default=OUT_DIR, help="出力先フォルダ")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="並列プロセス数")
+    parser.add_argument("--ai", action="store_true", help="Groq でAI分析する（環境変数 GROQ_API_KEY）")
+    parser.add_argument("--force", action="store_true", help="変更がなくても作り直す")
+    args = parser.parse_args()
+
+    api_key = os.environ.get("GROQ_API_KEY", "")
+    if args.ai and not api_key:
+        parser.error("--ai には環境変数 GROQ_API_KEY が必要です")
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest_path = os.path.join(args.out, MANIFEST_NAME)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    periods = list_periods(args.by, args.start, args.end)
+    todo = []
+    for label, keys in periods:
+        fp = input_fingerprint(keys, args.ai)
+        if not args.force and manifest.get(label) == fp:
+            continue
+        todo.append((label, keys, fp))
+    print(f"📊 対象 {len(periods)} 期間 / 作成 {len(todo)} 件（変更なし {len(periods) - len(todo)} 件はスキップ）")
+
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(build_report, label, keys, args.ai, api_key, args.out): fp for label, keys, fp in todo}
+        for future in as_completed(futures):
+            try:
+                label, path, complete = future.result()
+            except Exception as e:
+                print(f"⚠️ エラー: {e}")
+                continue
+            if path is None:
+                print(f"– {label}: データなし")
+                continue
+            if complete or not args.ai:
+                manifest[label] = futures[future]
+            print(f"✅ {label}: {path}")
+
+    with write_queue.atomic_write(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
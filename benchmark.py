@@ -0,0 +1,210 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import datetime
+import tempfile
+import subprocess
+import statistics
+from contextlib import redirect_stdout
+
+# =====================
+# 設定
+# =====================
+# 使い方:
+#   python benchmark.py                                   10万件で測定して benchmark_report.json に出力
+#   python benchmark.py --scales 100000,1000000,10000000  件数を変えて測定
+#   python benchmark.py --baseline old_report.json        前回より遅くなった項目があれば終了コード 1
+# 件数ごとに空の作業フォルダと別プロセスで測るので、キャッシュやスナップショットは毎回作り直しになる。
+# データは make_dummy_data.py で作る（シードと最後の日付を固定しているので毎回同じ）。
+REPORT_FILE = "benchmark_report.json"
+DEFAULT_SCALES = [100000]
+SEED = 42
+END_DATE = datetime.datetime(2025, 12, 31, 23, 59)
+DATA_SHAPE = {"callers": 2000, "employees": 50, "memos": 200}
+SAVE_WRITES = 100      # save_history を何回測るか
+REPEAT = 5             # 温まった状態の処理を何回測るか
+TOLERANCE = 0.25       # 前回の中央値よりこの割合以上遅ければ劣化とみなす
+MIN_DELTA_MS = 5.0     # ただし差がこれ未満なら誤差として無視
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _stats(samples):
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        "n": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "p50_ms": round(statistics.median(ms), 3),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+        "max_ms": round(ms[-1], 3),
+    }
+
+
+def _measure(func, repeat=1):
+    samples, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - t0)
+    return _stats(samples), result
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_scale(rows, seed=SEED, writes=SAVE_WRITES, repeat=REPEAT):
+    # カレントフォルダ（空の作業フォルダ）に rows 件のデータを作り、各処理の時間を測る
+    import make_dummy_data
+    import history_store
+    import keywords
+    import pdf_report
+    import search_index
+    import caller_lookup
+    import analytics
+
+    results = {}
+    with redirect_stdout(io.StringIO()):
+        results["generate_store"], _ = _measure(lambda: make_dummy_data.generate_dummy_data(
+            rows, seed=seed, target="store", end_date=END_DATE, **DATA_SHAPE))
+
+    # 全期間の読み込み（初回はパース＋スナップショット作成、2回目以降はキャッシュ）
+    results["safe_load_history.cold"], _ = _measure(history_store.safe_load_history)
+    results["safe_load_history.warm"], _ = _measure(history_store.safe_load_history, repeat)
+
+    # 1件ずつの保存（書き込みキューに積んでから書き込み完了まで）
+    last_key = max(k for k in history_store.get_store().partitions())
+    dt = f"{last_key.replace('-', '/')}/28 12:00"
+
+    def save_loop(tag):
+        samples = []
+        for i in range(writes):
+            t0 = time.perf_counter()
+            history_store.save_history(dt, "佐藤さん", "田中課長", "", f"ベンチ商事{tag}{i}", "03-0000-0000",
+                                       "伝言のみ", "ベンチマーク用の記録です。").result()
+            samples.append(time.perf_counter() - t0)
+        return _stats(samples)
+
+    # 検索・かけてきた人の索引がまだ無い状態（追記時の索引の更新は空振りする）
+    results["save_history.no_index"] = save_loop("A")
+    results["safe_load_history.after_append"], _ = _measure(history_store.safe_load_history)
+
+    # 索引を作ってから測る（画面で検索した後の保存。追記時の索引の更新も含む）
+    results["search.cold"], _ = _measure(lambda: search_index.search("見積"))
+    results["search.warm"], _ = _measure(lambda: search_index.search("見積"), repeat)
+    results["caller_lookup.cold"], _ = _measure(lambda: caller_lookup.lookup("山田"))
+    results["caller_lookup.warm"], _ = _measure(lambda: caller_lookup.lookup("山田"), repeat)
+    results["save_history"] = save_loop("B")
+    results["search.after_append"], _ = _measure(lambda: search_index.search("見積"))
+    results["caller_lookup.after_append"], _ = _measure(lambda: caller_lookup.lookup("山田"))
+
+    # データ分析タブ: 期間の絞り込み＋相手先ランキング（全期間と直近1年）
+    def tab3(keys):
+        df = history_store.safe_load_history(["日時", "相手", "詳細"], keys).dropna(subset=["datetime"])
+        return df, history_store.rollup_counts("相手", keys).head(10)
+
+    all_keys = list(history_store.partition_index())
+    year_keys = [k for k in all_keys if k.startswith(last_key[:4])]
+    tab3(all_keys)
+    results["tab3.all"], (df_all, ranking) = _measure(lambda: tab3(all_keys), repeat)
+    results["tab3.year"], (df_year, _) = _measure(lambda: tab3(year_keys), repeat)
+
+    results["analytics.cold"], summary = _measure(lambda: analytics.summarize(all_keys))
+    results["analytics.all"], _ = _measure(lambda: analytics.summarize(all_keys), repeat)
+    results["analytics.year"], _ = _measure(lambda: analytics.summarize(year_keys), repeat)
+
+    results["keywords.year"], kw_df = _measure(lambda: keywords.extract_keywords(df_year["詳細"]))
+    results["keywords.all"], _ = _measure(lambda: keywords.extract_keywords(df_all["詳細"]))
+
+    report_text = "ベンチマーク用のレポート本文です。\n" * 20
+    results["pdf.cold"], _ = _measure(lambda: pdf_report.render_pdf(report_text, "ベンチ", ranking, kw_df))
+    results["pdf.cached"], _ = _measure(lambda: pdf_report.render_pdf(report_text, "ベンチ", ranking, kw_df), repeat)
+
+    return {"rows": rows, "peak_rss_mb": _peak_rss_mb(), "timings": results}
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    # 件数・項目が同じものの中央値を比べ、遅くなった項目を返す
+    regressions = []
+    for scale, cur in report["scales"].items():
+        old = baseline.get("scales", {}).get(scale)
+        if not old:
+            continue
+        for name, t in cur["timings"].items():
+            prev = old["timings"].get(name)
+            if prev is None:
+                continue
+            if t["p50_ms"] > prev["p50_ms"] * (1 + tolerance) and t["p50_ms"] - prev["p50_ms"] >= MIN_DELTA_MS:
+                regressions.append((scale, name, prev["p50_ms"], t["p50_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ダミーデータで主要な処理の時間を測定")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)), help="件数（カンマ区切り）")
+    parser.add_argument("--seed", type=int, default=SEED, help="乱数シード")
+    parser.add_argument("--writes", type=int, default=SAVE_WRITES, help="save_history の測定回数")
+    parser.add_argument("--out", default=REPORT_FILE, help="結果の JSON")
+    parser.add_argument("--baseline", help="比較する前回の結果の JSON")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="劣化とみなす遅延の割合")
+    parser.add_argument("--run-scale", type=int, help=argparse.SUPPRESS)  # 内部用: 子プロセスで1件数分を測る
+    args = parser.parse_args()
+
+    if args.run_scale:
+        json.dump(run_scale(args.run_scale, args.seed, args.writes), sys.stdout, ensure_ascii=False)
+        return
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "scales": {},
+    }
+    for rows in [int(s) for s in args.scales.split(",") if s.strip()]:
+        print(f"⏱️ {rows} 件で測定中...")
+        work_dir = tempfile.mkdtemp(prefix="call_bench_")
+        try:
+            proc = subprocess.run(
+                [sys.executable, os.path.join(REPO_DIR, "benchmark.py"), "--run-scale", str(rows),
+                 "--seed", str(args.seed), "--writes", str(args.writes)],
+                cwd=work_dir, capture_output=True, text=True, encoding="utf-8",
+                env=dict(os.environ, PYTHONPATH=REPO_DIR, HISTORY_BACKEND="jsonl"),
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if proc.returncode != 0:
+            print(f"⚠️ エラー: {rows} 件の測定に失敗しました\n{proc.stderr}")
+            sys.exit(2)
+        result = json.loads(proc.stdout)
+        report["scales"][str(rows)] = result
+        for name, t in result["timings"].items():
+            print(f"  {name:<32} p50 {t['p50_ms']:>10.1f} ms   p95 {t['p95_ms']:>10.1f} ms")
+        print(f"  peak RSS: {result['peak_rss_mb']} MB")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"🎉 完了！ 結果を {args.out} に保存しました")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for scale, name, before, after in regressions:
+            print(f"⚠️ 劣化: [{scale} 件] {name}: {before:.1f} ms → {after:.1f} ms")
+        if regressions:
+            sys.exit(1)
+        print("✅ 前回から劣化した項目はありません")
+
+
+if __name__ == "__main__":
+    main()
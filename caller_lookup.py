@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import bisect
+import unicodedata
+import pandas as pd
+
+import history_store
+import write_queue
+import instrumentation
+
+# =====================
+# 相手先の検索・自動入力（history_data/callers/YYYY-MM.json）
+# =====================
+# 月ごとに (相手, 電話番号) ごとの件数と直近の通話を集計して保存し、
+# それを全期間分まとめた「正規化した名前・電話番号の数字」の整列済みリストを前方一致（二分探索）で引く。
+# save_history の追記分は月の差分ファイル（YYYY-MM.delta.jsonl）に追記するだけで、月の集計全体は書き直さない
+# （差分・書き戻し・作り直しは history_store.DeltaIndex）。
+CALLER_DIR = os.path.join(history_store.STORE_DIR, "callers")
+RECENT_CALLS = 3      # 候補ごとに表示する直近の通話数
+MEMO_CHARS = 40       # 直近の通話に残す詳細メモの文字数
+MAX_SCAN = 500        # 前方一致で見る候補の上限（ここから最終通話の新しい順に並べる）
+COMPACT_EVERY = 500   # 差分ファイルの行数がこれに達したら月の集計に書き戻す
+HONORIFICS = ("様", "御中", "先生", "さん")
+COMPANY_PREFIXES = ("株式会社", "有限会社", "合同会社", "(株)", "(有)")
+
+_merged = {"sig": None}
+
+
+def normalize_name(name):
+    # 全角・半角、大文字・小文字、空白、末尾の敬称の違いを吸収する
+    text = re.sub(r"\s+", "", unicodedata.normalize("NFKC", str(name))).lower()
+    for h in HONORIFICS:
+        if text.endswith(h) and len(text) > len(h):
+            return text[:-len(h)]
+    return text
+
+
+def normalize_phone(phone):
+    return re.sub(r"\D", "", unicodedata.normalize("NFKC", str(phone)))
+
+
+def _name_keys(name):
+    # 「株式会社山田商事」は「山田」でも引けるように、会社の種類を除いた形も登録する
+    norm = normalize_name(name)
+    keys = {norm}
+    for p in COMPANY_PREFIXES:
+        if norm.startswith(p) and len(norm) > len(p):
+            keys.add(norm[len(p):])
+    return keys
+
+
+def _recent_entry(dt, req, memo):
+    return [str(dt), "" if req is None else str(req), "" if memo is None else str(memo)[:MEMO_CHARS]]
+
+
+def _add_calls(callers, rows):
+    # rows: (相手, 電話番号, 日時, 用件, 詳細) の並び
+    touched = set()
+    for name, phone, dt, req, memo in rows:
+        name = "" if name is None or name != name else str(name).strip()
+        if not name:
+            continue
+        phone = "" if phone is None or phone != phone else str(phone).strip()
+        pair = f"{name}\t{phone}"
+        ent = callers.setdefault(pair, {"count": 0, "recent": []})
+        ent["count"] += 1
+        ent["recent"].append(_recent_entry(dt, req, memo))
+        touched.add(pair)
+    for pair in touched:
+        callers[pair]["recent"] = sorted(callers[pair]["recent"], key=lambda r: r[0], reverse=True)[:RECENT_CALLS]
+    return callers
+
+
+def _dt_text(df):
+    # 並べ替えられるように「%Y/%m/%d %H:%M」にそろえる（読めない日時は元の文字列）
+    return df["datetime"].dt.strftime("%Y/%m/%d %H:%M").where(df["datetime"].notna(), df["日時"].astype(str))
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write(path, ent):
+    with write_queue.atomic_write(path, "w", encoding="utf-8") as f:
+        json.dump({"fp": ent["fp"], "callers": ent["callers"]}, f, ensure_ascii=False)
+    return ent
+
+
+def _build(df):
+    rows = zip(df["相手"], df["電話番号"], _dt_text(df), df["用件"], df["詳細"])
+    return {"callers": _add_calls({}, rows)}
+
+
+def _json_value(v):
+    return None if v is None or v != v else str(v)
+
+
+def _make_delta(rows):
+    # 追記した行を _add_calls の形（相手, 電話番号, 日時, 用件, 詳細）で
+    dts = pd.to_datetime(pd.Series([r.get("日時") for r in rows], dtype="object"), errors='coerce')
+    dt_text = [d.strftime("%Y/%m/%d %H:%M") if not pd.isna(d) else str(r.get("日時")) for d, r in zip(dts, rows)]
+    return [[_json_value(r.get("相手")), _json_value(r.get("電話番号")), dt, _json_value(r.get("用件")),
+             None if r.get("詳細") is None else str(r.get("詳細"))[:MEMO_CHARS]] for r, dt in zip(rows, dt_text)]
+
+
+def _apply(ent, calls):
+    _add_calls(ent["callers"], calls)
+
+
+# 月の集計: {"fp", "delta", "callers": {"相手\t電話番号": {"count", "recent": [[日時, 用件, 詳細], ...]}}}
+INDEX = history_store.DeltaIndex(CALLER_DIR, ".json", ("日時", "相手", "電話番号", "用件", "詳細"),
+                                 lambda: {"callers": {}}, _read, _write, _build, _make_delta, _apply,
+                                 compact_every=COMPACT_EVERY)
+history_store.register_append_hook(INDEX.on_append)
+
+
+def _index():
+    # 全月の集計をまとめた検索用リスト。どの月の指紋も変わっていなければ前回のものを使う
+    global _merged
+    store = history_store.get_store()
+    keys = store.partitions()
+    sig = tuple((k, store.fingerprint(k)) for k in keys)
+    merged = _merged
+    if merged["sig"] == sig:
+        return merged
+    totals = {}
+    for k in keys:
+        for pair, v in INDEX.entry(k)["callers"].items():
+            t = totals.setdefault(pair, {"count": 0, "recent": []})
+            t["count"] += v["count"]
+            t["recent"] = sorted(t["recent"] + v["recent"], key=lambda r: r[0], reverse=True)[:RECENT_CALLS]
+    callers, name_keys, phone_keys = [], [], []
+    for pair, v in totals.items():
+        name, phone = pair.split("\t", 1)
+        idx = len(callers)
+        callers.append({"相手": name, "電話番号": phone, "count": v["count"],
+                        "last": v["recent"][0][0] if v["recent"] else "",
+                        "recent": [{"日時": r[0], "用件": r[1], "詳細": r[2]} for r in v["recent"]]})
+        name_keys.extend((n, idx) for n in _name_keys(name))
+        digits = normalize_phone(phone)
+        if digits:
+            phone_keys.append((digits, idx))
+    name_keys.sort()
+    phone_keys.sort()
+    merged = {"sig": sig, "callers": callers,
+              "names": [k for k, _ in name_keys], "name_ids": [i for _, i in name_keys],
+              "phones": [k for k, _ in phone_keys], "phone_ids": [i for _, i in phone_keys]}
+    _merged = merged
+    return merged
+
+
+def _prefix(keys, ids, prefix):
+    found = []
+    i = bisect.bisect_left(keys, prefix)
+    while i < len(keys) and keys[i].startswith(prefix) and len(found) < MAX_SCAN:
+        found.append(ids[i])
+        i += 1
+    return found
+
+
+@instrumentation.timed("caller_lookup.lookup")
+def lookup(query, limit=5):
+    # 名前の先頭または電話番号の先頭で過去の相手先を探し、最終通話の新しい順に返す
+    # 戻り値: [{"相手", "電話番号", "count", "last", "recent": [{"日時", "用件", "詳細"}, ...]}, ...]
+    text = str(query).strip()
+    if not text:
+        return []
+    try:
+        idx = _index()
+    except Exception:
+        return []
+    found = set(_prefix(idx["names"], idx["name_ids"], normalize_name(text)))
+    digits = normalize_phone(text)
+    if len(digits) >= 2 and re.fullmatch(r"[\d\-()+\s]+", unicodedata.normalize("NFKC", text)):
+        found.update(_prefix(idx["phones"], idx["phone_ids"], digits))
+    ranked = sorted((idx["callers"][i] for i in found), key=lambda c: (c["last"], c["count"]), reverse=True)
+    return ranked[:limit]
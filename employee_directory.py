@@ -0,0 +1,128 @@
+import os
+import threading
+import pandas as pd
+
+import write_queue
+
+# =====================
+# 従業員ディレクトリ設定
+# =====================
+# employees.csv を ID 付きで読み込み、ID・名前・メールの索引と一緒にプロセス内で保持する。
+# ファイルの指紋（inode, mtime, size）が変わったとき（他のプロセスの書き込みを含む）だけ読み直す。
+# ID 列のない古いファイルは、初回読み込み時に 1, 2, 3... を振って書き戻す。
+# ID は削除しても使い回さない（次に振る ID を employees.csv.next_id に保持する）。
+EMPLOYEE_FILE = "employees.csv"
+NEXT_ID_FILE = EMPLOYEE_FILE + ".next_id"
+COLUMNS = ["ID", "名前", "メール"]
+DEFAULT_EMPLOYEES = [{"名前": "田中課長", "メール": "tanaka@test.com"}]
+
+_cache_lock = threading.Lock()
+_state = None  # {"fp", "df", "ids", "by_id", "by_name", "by_email", "labels"}
+
+
+def _fingerprint():
+    try:
+        st_ = os.stat(EMPLOYEE_FILE)
+    except OSError:
+        return None
+    return (st_.st_ino, st_.st_mtime_ns, st_.st_size)
+
+
+def _write(df):
+    with write_queue.atomic_write(EMPLOYEE_FILE, "w", encoding="utf-8-sig", newline="") as f:
+        df[COLUMNS].to_csv(f, index=False)
+
+
+def _read_file():
+    # 呼び出し側でロックを取っておくこと
+    if not os.path.exists(EMPLOYEE_FILE):
+        df = pd.DataFrame(DEFAULT_EMPLOYEES)
+        df.insert(0, "ID", range(1, len(df) + 1))
+        _write(df)
+        return df
+    df = pd.read_csv(EMPLOYEE_FILE, dtype={"名前": str, "メール": str}, keep_default_na=False, encoding="utf-8-sig")
+    if "ID" not in df.columns:
+        df.insert(0, "ID", range(1, len(df) + 1))
+        _write(df)
+    df["ID"] = df["ID"].astype(int)
+    return df[COLUMNS]
+
+
+def _next_id(df):
+    # 呼び出し側でロックを取っておくこと。保存した次の ID とファイル内の最大の ID + 1 の大きいほう
+    try:
+        with open(NEXT_ID_FILE, "r", encoding="utf-8") as f:
+            stored = int(f.read().strip())
+    except (OSError, ValueError):
+        stored = 1
+    return max(stored, int(df["ID"].max()) + 1 if not df.empty else 1)
+
+
+def _write_next_id(next_id):
+    with write_queue.atomic_write(NEXT_ID_FILE, "w", encoding="utf-8") as f:
+        f.write(str(next_id))
+
+
+def _refresh():
+    # 指紋が変わっていなければ前回の DataFrame と索引をそのまま使う
+    global _state
+    state = _state
+    if state is not None and state["fp"] == _fingerprint():
+        return state
+    with _cache_lock:
+        with write_queue.file_lock(EMPLOYEE_FILE + ".lock"):
+            df = _read_file()
+            fp = _fingerprint()  # 書き込みは同じロックの中なので、読んだ内容と指紋は一致する
+        by_id, by_name, by_email = {}, {}, {}
+        for emp_id, name, mail in df.itertuples(index=False, name=None):
+            by_id[emp_id] = {"ID": emp_id, "名前": name, "メール": mail}
+            by_name.setdefault(name, []).append(emp_id)
+            by_email.setdefault(mail.lower(), []).append(emp_id)
+        labels = {emp_id: f"{emp['名前']} : {emp['メール']}" for emp_id, emp in by_id.items()}
+        _state = {"fp": fp, "df": df, "ids": list(by_id), "by_id": by_id, "by_name": by_name, "by_email": by_email, "labels": labels}
+        return _state
+
+
+def load():
+    # 表示用の DataFrame（ID, 名前, メール）。キャッシュそのものなので書き換えないこと
+    return _refresh()["df"]
+
+
+def ids():
+    return list(_refresh()["ids"])
+
+
+def get(emp_id):
+    # {"ID", "名前", "メール"} を返す。見つからなければ None
+    return _refresh()["by_id"].get(emp_id)
+
+
+def find_by_name(name):
+    return list(_refresh()["by_name"].get(name, []))
+
+
+def find_by_email(email):
+    return list(_refresh()["by_email"].get(str(email).lower(), []))
+
+
+def labels():
+    # 選択肢の表示用 {ID: "名前 : メール"}
+    return _refresh()["labels"]
+
+
+def add(name, email):
+    # 読み込み→書き換え→置き換えをロックファイルで直列化する（同時に登録しても片方が消えない）
+    with write_queue.file_lock(EMPLOYEE_FILE + ".lock"):
+        df = _read_file()
+        new_id = _next_id(df)
+        _write_next_id(new_id + 1)  # 先に進めておく（途中で落ちても同じ ID を二度振らない）
+        _write(pd.concat([df, pd.DataFrame([{"ID": new_id, "名前": name, "メール": email}])], ignore_index=True))
+    return new_id
+
+
+def delete(emp_id):
+    # 最大の ID を消しても次の登録で同じ ID にならないよう、次に振る ID を先に保存する
+    with write_queue.file_lock(EMPLOYEE_FILE + ".lock"):
+        df = _read_file()
+        _write_next_id(_next_id(df))
+        _write(df[df["ID"] != emp_id])
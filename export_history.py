@@ -0,0 +1,107 @@
+import json
+import argparse
+import datetime
+
+import history_store
+from history_store import HISTORY_COLUMNS
+
+# =====================
+# 設定
+# =====================
+# 使い方:
+#   python export_history.py -o history.csv
+#   python export_history.py --format xlsx --start 2024-01-01 --end 2024-03-31 -o 2024Q1.xlsx
+#   python export_history.py --format jsonl --request 折り返しのお願い --query 田中 -o callback.jsonl
+# 月ごとに読み込んで書き出すので、メモリ使用量は全履歴ではなく1か月分程度で済む。
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "jsonl": ("application/x-ndjson", ".jsonl"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+}
+
+
+def _cell(v):
+    if v is None or (isinstance(v, float) and v != v):
+        return None
+    return v
+
+
+def _write_csv(path, parts):
+    count = 0
+    # Excel で文字化けしないよう employees.csv と同じ utf-8-sig
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        f.write(",".join(HISTORY_COLUMNS) + "\n")
+        for _, df in parts:
+            df.to_csv(f, header=False, index=False, lineterminator="\n")
+            count += len(df)
+    return count
+
+
+def _write_jsonl(path, parts):
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for _, df in parts:
+            for row in df.itertuples(index=False, name=None):
+                f.write(json.dumps({c: _cell(v) for c, v in zip(HISTORY_COLUMNS, row)},
+                                   ensure_ascii=False, default=str) + "\n")
+            count += len(df)
+    return count
+
+
+def _write_xlsx(path, parts):
+    # write_only モードは行をそのまま一時ファイルへ流すので、ブック全体をメモリに持たない
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    count = 0
+    for key, df in parts:
+        ws = wb.create_sheet(title=key)  # 従来どおり月ごとのシート
+        ws.append(HISTORY_COLUMNS)
+        for row in df.itertuples(index=False, name=None):
+            ws.append([_cell(v) for v in row])
+        count += len(df)
+    if count == 0:
+        wb.create_sheet(title="Unknown").append(HISTORY_COLUMNS)
+    wb.save(path)
+    return count
+
+
+_WRITERS = {"csv": _write_csv, "jsonl": _write_jsonl, "xlsx": _write_xlsx}
+
+
+def export_history(path, fmt="csv", start=None, end=None, requests=None, query=None):
+    # 条件に合う履歴を path に書き出し、書き出した件数を返す
+    if fmt not in _WRITERS:
+        raise ValueError(f"対応していない形式です: {fmt}（{' / '.join(EXPORT_FORMATS)}）")
+    parts = history_store.iter_history(start, end, requests, query)
+    return _WRITERS[fmt](path, parts)
+
+
+def _parse_day(text, end_of_day=False):
+    day = datetime.datetime.strptime(text, "%Y-%m-%d")
+    return day + datetime.timedelta(days=1, microseconds=-1) if end_of_day else day
+
+
+def main():
+    parser = argparse.ArgumentParser(description="通話履歴を csv / jsonl / xlsx に書き出し")
+    parser.add_argument("-o", "--output", required=True, help="出力ファイル")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), help="出力形式（省略時は拡張子から判断）")
+    parser.add_argument("--start", help="開始日 (YYYY-MM-DD)")
+    parser.add_argument("--end", help="終了日 (YYYY-MM-DD、この日を含む)")
+    parser.add_argument("--request", action="append", help="用件で絞り込み（複数指定可）")
+    parser.add_argument("--query", help="相手・電話番号・詳細の部分一致")
+    args = parser.parse_args()
+
+    fmt = args.format or next((k for k, (_, ext) in EXPORT_FORMATS.items() if args.output.lower().endswith(ext)), "csv")
+    try:
+        start = _parse_day(args.start) if args.start else None
+        end = _parse_day(args.end, end_of_day=True) if args.end else None
+    except ValueError:
+        parser.error("日付は YYYY-MM-DD 形式で指定してください")
+
+    history_store.get_store()  # 初回は既存の history.xlsx を先に取り込む
+    count = export_history(args.output, fmt, start, end, args.request, args.query)
+    print(f"🎉 完了！ {count} 件を {args.output} に書き出しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,809 @@
+import os
+import re
+import json
+import datetime
+import threading
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import write_queue
+import instrumentation
+
+# =====================
+# 履歴ストレージ設定
+# =====================
+# HISTORY_BACKEND=jsonl : 月ごとの追記専用ファイル（history_data/YYYY-MM.jsonl）
+# HISTORY_BACKEND=excel : 従来どおり history.xlsx の月シートを書き換え
+HISTORY_COLUMNS = ["日時", "From", "To", "CC", "相手", "電話番号", "用件", "詳細"]
+DATA_FILE = "history.xlsx"
+STORE_DIR = "history_data"
+BACKEND = os.environ.get("HISTORY_BACKEND", "jsonl")
+
+
+def partition_key(dt):
+    # save_history のシート名と同じ「%Y-%m」キー
+    try:
+        return pd.to_datetime(dt).strftime("%Y-%m")
+    except Exception:
+        return "Unknown"
+
+
+def _json_default(v):
+    if isinstance(v, (pd.Timestamp, datetime.datetime)):
+        return v.strftime("%Y/%m/%d %H:%M")
+    return str(v)
+
+
+def _clean_value(v):
+    # Excel由来の NaN は null として保存（読み込み時に NaN へ戻る）
+    if v is None or (isinstance(v, float) and v != v):
+        return None
+    return v
+
+
+# =====================
+# バックエンド: JSONL（追記専用）
+# =====================
+class JsonlHistoryStore:
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self.lock_path = os.path.join(root, ".lock")
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.jsonl")
+
+    def partitions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(n[:-6] for n in os.listdir(self.root) if n.endswith(".jsonl"))
+
+    def fingerprint(self, key):
+        # (inode, mtime, size)。inode が同じでサイズだけ増えていれば追記のみ
+        try:
+            st_ = os.stat(self._path(key))
+        except OSError:
+            return None
+        return (st_.st_ino, st_.st_mtime_ns, st_.st_size)
+
+    def append(self, key, rows):
+        # 1回の書き込みで末尾に追加するだけなので、履歴の総量に関係なく O(1)
+        os.makedirs(self.root, exist_ok=True)
+        lines = "".join(
+            json.dumps({c: _clean_value(r.get(c)) for c in HISTORY_COLUMNS},
+                       ensure_ascii=False, default=_json_default) + "\n"
+            for r in rows
+        )
+        data = lines.encode("utf-8")
+        # バッファを通さずに書く（失敗時に書き残しが close で後から追記されないように）
+        with open(self._path(key), "ab", buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[f.write(view):]
+                os.fsync(f.fileno())
+            except OSError as e:
+                # 書きかけの分を切り詰めてから投げ直す（write_queue が再試行しても同じ行を二重に書かない）
+                try:
+                    f.truncate(size)
+                except OSError:
+                    # 切り詰められなければ、どこまで書けたかわからないので再試行させない
+                    raise RuntimeError(f"追記に失敗し、書きかけの行を取り除けませんでした: {e}") from e
+                raise
+        instrumentation.add("history.bytes_written", len(data))
+
+    def read_from(self, key, offset=0):
+        # offset バイト目以降の完全な行だけを読み、(DataFrame, 次の offset) を返す
+        try:
+            with open(self._path(key), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+            instrumentation.add("history.bytes_read", len(data))
+        except OSError:
+            return pd.DataFrame(columns=HISTORY_COLUMNS), offset
+        end = data.rfind(b"\n") + 1  # 書き込み途中の最終行は次回に回す
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return pd.DataFrame.from_records(records, columns=HISTORY_COLUMNS), offset + end
+
+    def read(self, key):
+        return self.read_from(key)[0]
+
+    def import_excel(self, path):
+        # 既存の history.xlsx を月シートごとに取り込む（初回のみ）
+        all_sheets = pd.read_excel(path, sheet_name=None, engine="openpyxl")
+        for sheet_name, sheet_df in all_sheets.items():
+            if sheet_df.empty:
+                continue
+            self.append(sheet_name, sheet_df.to_dict("records"))
+
+
+# =====================
+# バックエンド: Excel（従来方式）
+# =====================
+class ExcelHistoryStore:
+    def __init__(self, path=DATA_FILE):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._entries_cache = None
+
+    def _sheet_entries(self):
+        # xlsx(zip) 内の各シートXMLの CRC とサイズをシートの指紋として使う
+        try:
+            st_ = os.stat(self.path)
+        except OSError:
+            return {}
+        file_fp = (st_.st_mtime_ns, st_.st_size)
+        if self._entries_cache and self._entries_cache[0] == file_fp:
+            return self._entries_cache[1]
+        import zipfile
+        import xml.etree.ElementTree as ET
+        ns_main = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+        ns_rel = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+        ns_pkg = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+        entries = {}
+        with zipfile.ZipFile(self.path) as zf:
+            rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+            targets = {r.get("Id"): r.get("Target") for r in rels.iter(f"{ns_pkg}Relationship")}
+            book = ET.fromstring(zf.read("xl/workbook.xml"))
+            for sheet in book.iter(f"{ns_main}sheet"):
+                target = targets.get(sheet.get(f"{ns_rel}id"), "")
+                member = target.lstrip("/") if target.startswith("/") else "xl/" + target
+                try:
+                    info = zf.getinfo(member)
+                    entries[sheet.get("name")] = (info.CRC, info.file_size)
+                except KeyError:
+                    entries[sheet.get("name")] = file_fp
+        self._entries_cache = (file_fp, entries)
+        return entries
+
+    def partitions(self):
+        try:
+            return sorted(self._sheet_entries())
+        except Exception:
+            return []
+
+    def fingerprint(self, key):
+        try:
+            return self._sheet_entries().get(key)
+        except Exception:
+            return None
+
+    def append(self, key, rows):
+        new_rows = pd.DataFrame(rows, columns=HISTORY_COLUMNS)
+        if not os.path.exists(self.path):
+            with pd.ExcelWriter(self.path, engine="openpyxl") as writer:
+                new_rows.to_excel(writer, sheet_name=key, index=False)
+            return
+        try:
+            existing_df = pd.read_excel(self.path, sheet_name=key, engine="openpyxl")
+            updated_df = pd.concat([existing_df, new_rows], ignore_index=True)
+        except Exception:
+            updated_df = new_rows
+        # コピーに書き込んでから置き換える（途中で落ちても元のブックは壊れない）
+        import shutil
+        tmp = f"{self.path}.{os.getpid()}.tmp.xlsx"
+        try:
+            shutil.copy2(self.path, tmp)
+            with pd.ExcelWriter(tmp, mode='a', engine="openpyxl", if_sheet_exists='replace') as writer:
+                updated_df.to_excel(writer, sheet_name=key, index=False)
+            os.replace(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def read(self, key):
+        try:
+            df = pd.read_excel(self.path, sheet_name=key, engine="openpyxl")
+        except Exception:
+            return pd.DataFrame(columns=HISTORY_COLUMNS)
+        for c in HISTORY_COLUMNS:
+            if c not in df.columns: df[c] = ""
+        return df
+
+
+BACKENDS = {
+    "jsonl": JsonlHistoryStore,
+    "excel": ExcelHistoryStore,
+}
+
+_store = None
+_store_lock = threading.Lock()
+IMPORT_MARKER = ".imported"  # history.xlsx を取り込み済みの印（history_data/.imported）
+
+
+def _import_excel_once(store):
+    # history.xlsx を一度だけ取り込む。history_data/ は excel バックエンドの索引やスナップショットでも
+    # 作られるので、フォルダの有無ではなく月ファイル（*.jsonl）と取り込み済みの印で判断する。
+    # 同じプロセスのスレッド同士・他のプロセスとはロックファイルで直列化し、ロックの中でもう一度確かめる
+    marker = os.path.join(store.root, IMPORT_MARKER)
+    if os.path.exists(marker) or store.partitions() or not os.path.exists(DATA_FILE):
+        return
+    with write_queue.file_lock(store.lock_path):
+        if os.path.exists(marker) or store.partitions():
+            return
+        # 呼び出しごとの一時フォルダに取り込んでから月ファイルを移す（途中で落ちても書きかけの月は残らない）
+        import shutil
+        tmp_root = f"{store.root}.import-{os.getpid()}-{threading.get_ident()}"
+        try:
+            JsonlHistoryStore(tmp_root).import_excel(DATA_FILE)
+            for name in os.listdir(tmp_root) if os.path.isdir(tmp_root) else []:
+                if name.endswith(".jsonl"):
+                    os.replace(os.path.join(tmp_root, name), os.path.join(store.root, name))
+            with open(marker, "w", encoding="utf-8") as f:
+                f.write(DATA_FILE)
+        finally:
+            shutil.rmtree(tmp_root, ignore_errors=True)
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = BACKENDS[BACKEND]()
+                if isinstance(store, JsonlHistoryStore):
+                    _import_excel_once(store)
+                _store = store
+    return _store
+
+
+# =====================
+# 公開API
+# =====================
+# 読み込みキャッシュ（プロセス内で共有。Streamlit の再実行をまたいで保持される）
+_cache_lock = threading.Lock()
+_partition_cache = {}  # (key, columns) -> {"fp", "offset", "df"}
+_combined_cache = {}   # (columns, partitions) -> {"fps", "df"}
+COMBINED_CACHE_SIZE = 8
+
+
+# =====================
+# 読み込み時の型（カテゴリ型・datetime64・電話番号の数字）
+# =====================
+# 同じ値が繰り返し出る列はカテゴリ型（値の辞書＋行ごとの番号）にして、メモリと groupby / value_counts を軽くする。
+# 派生列: "datetime"（日時をパースしたもの）、"phone_digits"（電話番号の数字だけ。電話番号を読むときだけ付く）
+# スナップショットにもこの型のまま保存する。型を変えたら SCHEMA_VERSION を上げる（古いスナップショットは作り直し）
+CATEGORY_COLUMNS = ("From", "To", "CC", "相手", "電話番号", "用件")
+DATETIME_FORMAT = "%Y/%m/%d %H:%M"
+SCHEMA_VERSION = 2
+
+
+def _object_categories(s):
+    # 辞書の型を object にそろえる（月ごとに str / object / 空の float が混ざると連結できない）
+    cats = s.cat.categories
+    if cats.dtype == object:
+        return s
+    return pd.Series(pd.Categorical.from_codes(s.cat.codes, pd.Index(cats, dtype="object")), index=s.index)
+
+
+def _as_category(s):
+    cat = s.astype("category")
+    if not all(isinstance(v, str) for v in cat.cat.categories):
+        # Excel 由来の数値などは文字列にそろえる（1 と "1" が別の値にならないように）
+        cat = s.where(s.isna(), s.astype(str)).astype("category")
+    return _object_categories(cat)
+
+
+def _phone_digits(s):
+    # 全角・半角をそろえて数字だけ残す（辞書だけを変換して行へ展開）
+    cats = pd.Series(s.cat.categories, dtype="object")
+    digits = cats.str.normalize("NFKC").str.replace(r"\D", "", regex=True).to_numpy(dtype=object)
+    return pd.Series(np.append(digits, None)[s.cat.codes.to_numpy()], index=s.index, dtype="object").astype("category")
+
+
+def _parse_dates(df):
+    # 保存形式（%Y/%m/%d %H:%M）は形式を指定して一括で、それ以外の書き方だけ個別にパースする
+    dts = pd.to_datetime(df["日時"], format=DATETIME_FORMAT, errors='coerce')
+    rest = dts.isna() & df["日時"].notna()
+    if rest.any():
+        dts[rest] = pd.to_datetime(df.loc[rest, "日時"].astype(str), errors='coerce', format="mixed")
+    df["datetime"] = dts
+    for c in CATEGORY_COLUMNS:
+        if c in df.columns:
+            df[c] = _as_category(df[c])
+    if "電話番号" in df.columns:
+        df["phone_digits"] = _phone_digits(df["電話番号"])
+    return df
+
+
+def _concat(frames):
+    # カテゴリ型の列は辞書を合わせて連結する（そのまま pd.concat すると辞書が違う列は object に戻る）
+    columns = frames[0].columns
+    cat_cols = [c for c in columns if all(isinstance(f[c].dtype, pd.CategoricalDtype) for f in frames)]
+    df = pd.concat([f.drop(columns=cat_cols) for f in frames], ignore_index=True)
+    for c in cat_cols:
+        df[c] = union_categoricals([_object_categories(f[c]) for f in frames], ignore_order=True)
+    return df[columns]
+
+
+# =====================
+# 列指向スナップショット（history_data/snapshot/YYYY-MM.parquet）
+# =====================
+# pyarrow がある場合のみ有効。元データの指紋をメタデータに持ち、
+# 追記で指紋が変わった月だけ次回読み込み時に作り直す。
+SNAPSHOT_DIR = os.path.join(STORE_DIR, "snapshot")
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+def _snapshot_path(key):
+    return os.path.join(SNAPSHOT_DIR, f"{key}.parquet")
+
+
+def _read_snapshot(key, fp, columns):
+    if pq is None or fp is None:
+        return None
+    path = _snapshot_path(key)
+    try:
+        meta = pq.read_schema(path).metadata or {}
+        source = json.loads(meta.get(b"history_source", b"null"))
+        if not source or source["fp"] != list(fp) or source.get("schema") != SCHEMA_VERSION:
+            return None
+        read_cols = None if columns is None else _with_derived(columns)
+        df = pq.read_table(path, columns=read_cols).to_pandas()
+        for c in CATEGORY_COLUMNS + ("phone_digits",):
+            # すべて空の列は parquet では null 型になり、カテゴリ型に戻らない
+            if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+                df[c] = _as_category(df[c])
+        return df, source["offset"]
+    except Exception:
+        return None
+
+
+def _write_snapshot(key, fp, offset, df):
+    if pq is None or fp is None:
+        return
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        meta = dict(table.schema.metadata or {})
+        meta[b"history_source"] = json.dumps({"fp": list(fp), "offset": offset, "schema": SCHEMA_VERSION}).encode()
+        with write_queue.atomic_write(_snapshot_path(key), "wb") as f:
+            pq.write_table(table.replace_schema_metadata(meta), f)
+    except Exception:
+        pass  # スナップショットは高速化用の副産物なので、失敗しても元データから読めればよい
+
+
+def _with_derived(columns):
+    return list(columns) + ["datetime"] + (["phone_digits"] if "電話番号" in columns else [])
+
+
+def _project(df, columns):
+    return df if columns is None else df[_with_derived(columns)]
+
+
+def _load_partition(store, key, columns):
+    fp = store.fingerprint(key)
+    ent = _partition_cache.get((key, columns))
+    if ent is not None and ent["fp"] == fp:
+        return ent["df"]
+    if (ent is not None and fp is not None and ent["fp"] is not None and hasattr(store, "read_from")
+            and fp[0] == ent["fp"][0] and fp[2] >= ent["offset"]):
+        # 追記分だけ読み込んで既存のパース結果に連結
+        tail, offset = store.read_from(key, ent["offset"])
+        df = _concat([ent["df"], _project(_parse_dates(tail), columns)]) if len(tail) else ent["df"]
+    else:
+        snap = _read_snapshot(key, fp, columns)
+        if snap is not None:
+            df, offset = snap
+        else:
+            if hasattr(store, "read_from"):
+                df, offset = store.read_from(key)
+            else:
+                df, offset = store.read(key), None
+            df = _parse_dates(df)
+            _write_snapshot(key, fp, offset, df)
+            df = _project(df, columns)
+    _partition_cache[(key, columns)] = {"fp": fp, "offset": offset, "df": df}
+    return df
+
+
+def load_partition(key, columns=None):
+    # 1か月分をファイル内の順序のまま (指紋, DataFrame) で返す。追記しても既存行の位置は変わらない
+    columns = None if columns is None else tuple(c for c in columns if c in HISTORY_COLUMNS)
+    store = get_store()
+    with _cache_lock:
+        df = _load_partition(store, key, columns)
+        return _partition_cache[(key, columns)]["fp"], df
+
+
+def _empty_history(columns=None):
+    columns = HISTORY_COLUMNS if columns is None else list(columns)
+    df = pd.DataFrame({c: pd.Series(dtype="category" if c in CATEGORY_COLUMNS else "object") for c in columns})
+    df["datetime"] = pd.Series(dtype="datetime64[ns]")
+    if "電話番号" in columns:
+        df["phone_digits"] = pd.Series(dtype="category")
+    return df
+
+
+@instrumentation.timed("history.load")
+def safe_load_history(columns=None, partitions=None):
+    # 変更のあった月だけ再パースし、結合・ソート済みの DataFrame を使い回す
+    # columns を指定すると、その列（と "datetime"）だけをスナップショットから読む
+    # partitions（"YYYY-MM" のリスト）を指定すると、その月だけを読む
+    # （"datetime" 列はパース済み。From/To/CC/相手/電話番号/用件 はカテゴリ型。
+    #   呼び出し側で列を追加しても共有キャッシュは変わらない）
+    columns = None if columns is None else tuple(c for c in columns if c in HISTORY_COLUMNS)
+    try:
+        store = get_store()
+        with _cache_lock:
+            all_keys = store.partitions()
+            for gone in [ck for ck in _partition_cache if ck[0] not in all_keys]:
+                del _partition_cache[gone]
+            keys = all_keys if partitions is None else [k for k in all_keys if k in set(partitions)]
+            frames = [_load_partition(store, k, columns) for k in keys]
+            fps = tuple((k, _partition_cache[(k, columns)]["fp"], len(f)) for k, f in zip(keys, frames))
+            cache_key = (columns, None if partitions is None else tuple(keys))
+            combined = _combined_cache.get(cache_key)
+            if combined is None or combined["fps"] != fps:
+                frames = [f for f in frames if not f.empty]
+                if frames:
+                    df_combined = _concat(frames)
+                    df_combined = df_combined.sort_values("datetime", ascending=False, kind="stable")
+                else:
+                    df_combined = _empty_history(columns)
+                _combined_cache.pop(cache_key, None)
+                while len(_combined_cache) >= COMBINED_CACHE_SIZE:
+                    del _combined_cache[next(iter(_combined_cache))]
+                combined = _combined_cache[cache_key] = {"fps": fps, "df": df_combined}
+            return combined["df"].copy(deep=False)
+    except Exception:
+        return _empty_history(columns)
+
+
+# =====================
+# 月パーティション索引（history_data/_index.json）
+# =====================
+# 月キー -> {"fp", "rows", "min", "max"}。save_history で1行分ずつ更新し、
+# 指紋が合わない月（他プロセスの書き込みなど）だけ読み直して作り直す。
+INDEX_FILE = os.path.join(STORE_DIR, "_index.json")
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with write_queue.atomic_write(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+
+
+def _read_index():
+    return _read_json(INDEX_FILE)
+
+
+def _write_index(index):
+    _write_json(INDEX_FILE, index)
+
+
+def _fmt_ts(ts):
+    return None if pd.isna(ts) else pd.Timestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@instrumentation.timed("history.partition_index")
+def partition_index():
+    # {月キー: {"rows": 件数, "min": Timestamp, "max": Timestamp}} を月キー順で返す
+    try:
+        store = get_store()
+        with _cache_lock:
+            index = _read_index()
+            keys = store.partitions()
+            changed = set(index) - set(keys)
+            for k in changed:
+                del index[k]
+            for k in keys:
+                fp = store.fingerprint(k)
+                ent = index.get(k)
+                if ent is not None and fp is not None and ent["fp"] == list(fp):
+                    continue
+                dts = _load_partition(store, k, ("日時",))["datetime"]
+                index[k] = {"fp": None if fp is None else list(fp), "rows": int(len(dts)),
+                            "min": _fmt_ts(dts.min()), "max": _fmt_ts(dts.max())}
+                changed.add(k)
+            if changed:
+                _write_index(index)
+        return {k: {"rows": index[k]["rows"],
+                    "min": pd.Timestamp(index[k]["min"]) if index[k]["min"] else pd.NaT,
+                    "max": pd.Timestamp(index[k]["max"]) if index[k]["max"] else pd.NaT}
+                for k in keys}
+    except Exception:
+        return {}
+
+
+def _update_index_on_append(key, fp_before, fp_after, dts):
+    # 追記前の指紋が索引と一致しているときだけ差分更新（それ以外は次回の partition_index で再計算）
+    if fp_after is None:
+        return
+    index = _read_index()
+    ent = index.get(key)
+    if ent is None and fp_before is None:
+        ent = index[key] = {"fp": None, "rows": 0, "min": None, "max": None}  # 新しい月
+    elif ent is None or fp_before is None or ent["fp"] != list(fp_before):
+        return
+    valid = [d for d in dts if not pd.isna(d)]
+    lo = ([ent["min"]] if ent["min"] else []) + ([_fmt_ts(min(valid))] if valid else [])
+    hi = ([ent["max"]] if ent["max"] else []) + ([_fmt_ts(max(valid))] if valid else [])
+    ent["rows"] += len(dts)
+    ent["min"] = min(lo) if lo else None
+    ent["max"] = max(hi) if hi else None
+    ent["fp"] = list(fp_after)
+    _write_index(index)
+
+
+# =====================
+# 月別集計（history_data/rollups/YYYY-MM.json）
+# =====================
+# 月ごとの 相手 / 用件 / To の件数。save_history で1行分ずつ加算するので、
+# 年間・全期間のランキングは月別の小さな集計を足し合わせるだけで済む。
+ROLLUP_DIR = os.path.join(STORE_DIR, "rollups")
+ROLLUP_FIELDS = ("相手", "用件", "To")
+_rollup_cache = {}  # key -> {"fp", "counts"}
+
+
+def _rollup_path(key):
+    return os.path.join(ROLLUP_DIR, f"{key}.json")
+
+
+def _partition_rollup(store, key):
+    fp = store.fingerprint(key)
+    fp_list = None if fp is None else list(fp)
+    ent = _rollup_cache.get(key)
+    if ent is not None and ent["fp"] == fp_list:
+        return ent["counts"]
+    ent = _read_json(_rollup_path(key))
+    if not ent or ent.get("fp") != fp_list:
+        df = _load_partition(store, key, ROLLUP_FIELDS)
+        ent = {"fp": fp_list,
+               "counts": {c: {str(k): int(v) for k, v in df[c].value_counts().items() if v} for c in ROLLUP_FIELDS}}
+        _write_json(_rollup_path(key), ent)
+    _rollup_cache[key] = ent
+    return ent["counts"]
+
+
+@instrumentation.timed("history.rollup_counts")
+def rollup_counts(field, partitions=None):
+    # 指定した月（None なら全月）の field 別件数を、value_counts() と同じ形の Series で返す
+    try:
+        store = get_store()
+        with _cache_lock:
+            keys = store.partitions()
+            if partitions is not None:
+                keys = [k for k in keys if k in set(partitions)]
+            total = {}
+            for k in keys:
+                for name, n in _partition_rollup(store, k)[field].items():
+                    total[name] = total.get(name, 0) + n
+    except Exception:
+        total = {}
+    counts = pd.Series(total, dtype="int64").sort_values(ascending=False, kind="stable")
+    counts.index.name = field
+    counts.name = "count"
+    return counts
+
+
+def _update_rollup_on_append(key, fp_before, fp_after, rows):
+    if fp_after is None:
+        return
+    ent = _read_json(_rollup_path(key))
+    if not ent and fp_before is None:
+        ent = {"fp": None, "counts": {c: {} for c in ROLLUP_FIELDS}}  # 新しい月
+    elif not ent or fp_before is None or ent.get("fp") != list(fp_before):
+        return
+    for r in rows:
+        for c in ROLLUP_FIELDS:
+            v = _clean_value(r.get(c))
+            if v is None:
+                continue
+            ent["counts"][c][str(v)] = ent["counts"][c].get(str(v), 0) + 1
+    ent["fp"] = list(fp_after)
+    _write_json(_rollup_path(key), ent)
+    _rollup_cache[key] = ent
+
+
+# 追記のたびに呼ぶ派生索引の更新関数 func(key, fp_before, fp_after, rows)（search_index.py などが登録）
+# 登録していないプロセスの追記は、指紋の不一致から次回の参照時に作り直される
+_append_hooks = []
+
+
+def register_append_hook(func):
+    _append_hooks.append(func)
+
+
+# =====================
+# 月ごとの派生索引（ベース＋追記の差分ファイル）
+# =====================
+# search_index.py（検索索引）と caller_lookup.py（相手先の集計）が使う共通部分。月ごとに
+#   ベース  directory/YYYY-MM<suffix>     : ある時点までの索引（元データの指紋 "fp" つき）
+#   差分    directory/YYYY-MM.delta.jsonl : 追記1回ごとに {"fp_before", "fp_after", "delta"} の1行
+# を置く。読むときはベースに「追記前の指紋がつながる差分」だけを順に足し、
+# 元データの指紋と合わない月（登録のないプロセスが追記した等）はその月だけ作り直す。
+# 差分が compact_every 行に達したら、足し終えた状態をベースに書き戻して差分ファイルを消す。
+# 索引の中身は呼び出し側の関数で扱う:
+#   empty()            空の索引（dict）      read(path) / write(path, ent)  ベースの読み書き（write は保持する索引を返す）
+#   build(df)          1か月分から作る       make_delta(rows) / apply(ent, delta)  追記分の差分を作る / 索引に足す
+# "fp" と "delta"（差分の行数）はこのクラスが管理する。
+class DeltaIndex:
+    def __init__(self, directory, suffix, columns, empty, read, write, build, make_delta, apply, compact_every=500):
+        self.directory = directory
+        self.suffix = suffix
+        self.columns = columns
+        self.compact_every = compact_every
+        self._empty, self._read, self._write = empty, read, write
+        self._build, self._make_delta, self._apply = build, make_delta, apply
+        self._lock = threading.Lock()
+        self._cache = {}  # key -> 索引
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def delta_path(self, key):
+        return os.path.join(self.directory, f"{key}.delta.jsonl")
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _load(self, key):
+        # ベース（無ければ空の索引）に、指紋がつながる差分を順に足す
+        try:
+            ent = self._read(self.path(key))
+        except Exception:
+            ent = None
+        if ent is None:
+            ent = dict(self._empty(), fp=None)
+        ent["delta"] = 0
+        try:
+            with open(self.delta_path(key), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        d = json.loads(line)
+                        fp_before, fp_after, delta = d["fp_before"], d["fp_after"], d["delta"]
+                    except (ValueError, KeyError, TypeError):
+                        continue  # 書きかけの行
+                    ent["delta"] += 1
+                    if fp_before == ent["fp"]:
+                        self._apply(ent, delta)
+                        ent["fp"] = fp_after
+        except OSError:
+            pass
+        return ent
+
+    def _compact(self, key, ent):
+        # 足し終えた状態をベースに書き、差分ファイルを消す
+        # （派生索引なので、書けなければ差分を残したまま使い続け、次の機会にまとめ直す）
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            ent = dict(self._write(self.path(key), ent), fp=ent["fp"], delta=0)
+            if os.path.exists(self.delta_path(key)):
+                os.remove(self.delta_path(key))
+        except Exception:
+            pass
+        return ent
+
+    def entry(self, key):
+        # 元データの指紋が合えばメモリ→ファイル（ベース＋差分）の順に使い、合わなければその月だけ作り直す
+        # （追記時は append_rows がロックを持ったまま on_append を呼ぶので、
+        #   self._lock を持ったまま load_partition は呼ばない）
+        store = get_store()
+        fp = store.fingerprint(key)
+        fp_list = None if fp is None else list(fp)
+        with self._lock:
+            ent = self._cache.get(key)
+            if ent is None or ent["fp"] != fp_list:
+                ent = self._load(key)
+            if ent["fp"] == fp_list and fp_list is not None and ent["delta"] < self.compact_every:
+                self._cache[key] = ent
+                return ent
+        if ent["fp"] != fp_list or fp_list is None:
+            fp_loaded, df = load_partition(key, self.columns)
+            ent = dict(self._build(df), fp=None if fp_loaded is None else list(fp_loaded), delta=0)
+        # ベースへの書き戻しは追記と同じロックの中で、元データがこの索引の時点のままのときだけ
+        # （その間に追記されていれば差分ファイルを消さず、メモリ上の索引だけを使う）
+        with write_queue.file_lock(store.lock_path), self._lock:
+            fp_now = store.fingerprint(key)
+            if ent["fp"] == (None if fp_now is None else list(fp_now)):
+                ent = self._compact(key, ent)
+            self._cache[key] = ent
+        return ent
+
+    def on_append(self, key, fp_before, fp_after, rows):
+        # append_rows の追記フック。追記分を差分ファイルに1行で足す（ベースは読まない・書き直さない）
+        if fp_after is None:
+            return
+        d = {"fp_before": None if fp_before is None else list(fp_before), "fp_after": list(fp_after),
+             "delta": self._make_delta(rows)}
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.delta_path(key), "a", encoding="utf-8") as f:
+                f.write(json.dumps(d, ensure_ascii=False) + "\n")
+            ent = self._cache.get(key)
+            if ent is None:
+                return
+            if ent["fp"] != d["fp_before"]:
+                self._cache.pop(key, None)
+                return
+            self._apply(ent, d["delta"])
+            ent["fp"] = d["fp_after"]
+            ent["delta"] += 1
+            if ent["delta"] >= self.compact_every:
+                self._cache[key] = self._compact(key, ent)
+
+
+@instrumentation.timed("history.append")
+def append_rows(key, rows):
+    # 同じ月の行をまとめて1回で追記し、索引と月別集計も差分で更新する
+    # ロックファイルで他のプロセス（別サーバー・取り込みCLI）の書き込みと直列化する
+    if not rows:
+        return
+    store = get_store()
+    dts = pd.to_datetime(pd.Series([r.get("日時") for r in rows], dtype="object"), errors='coerce').tolist()
+    with write_queue.file_lock(store.lock_path), _cache_lock:
+        fp_before = store.fingerprint(key)
+        store.append(key, rows)
+        fp_after = store.fingerprint(key)
+        try:
+            _update_index_on_append(key, fp_before, fp_after, dts)
+            _update_rollup_on_append(key, fp_before, fp_after, rows)
+        except Exception:
+            pass
+        for hook in _append_hooks:
+            try:
+                hook(key, fp_before, fp_after, rows)
+            except Exception:
+                pass
+
+
+def save_history(dt, f, t, c, caller, tel, req, memo):
+    row = {
+        "日時": dt, "From": f, "To": t, "CC": c,
+        "相手": caller, "電話番号": tel, "用件": req, "詳細": memo
+    }
+    # 書き込みスレッドに任せてすぐ戻る。同じ月に溜まった行は1回の追記にまとまる
+    key = partition_key(dt)
+    return write_queue.submit(lambda rows: append_rows(key, rows), [row], merge_key=("history", key))
+
+
+def iter_history(start=None, end=None, requests=None, query=None):
+    # 条件に合う行を月ごとの DataFrame として順に返す（全履歴を一度にメモリへ載せない）
+    # start / end: 日時（両端を含む）、requests: 用件のリスト、query: 相手・電話番号・詳細の部分一致
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    store = get_store()
+    for key in store.partitions():
+        if start is not None or end is not None:
+            if not re.match(r"^\d{4}-\d{2}$", key):
+                continue
+            if (start is not None and key < start.strftime("%Y-%m")) or (end is not None and key > end.strftime("%Y-%m")):
+                continue
+        df = store.read(key)
+        if df.empty:
+            continue
+        mask = pd.Series(True, index=df.index)
+        if start is not None or end is not None:
+            dts = pd.to_datetime(df["日時"], errors='coerce')
+            if start is not None: mask &= dts >= start
+            if end is not None: mask &= dts <= end
+        if requests:
+            mask &= df["用件"].isin(list(requests))
+        if query:
+            hit = pd.Series(False, index=df.index)
+            for c in ("相手", "電話番号", "詳細"):
+                hit |= df[c].astype(str).str.contains(query, regex=False, na=False)
+            mask &= hit
+        df = df.loc[mask, HISTORY_COLUMNS]
+        if not df.empty:
+            yield key, df
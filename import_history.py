@@ -0,0 +1,115 @@
+import os
+import argparse
+import pandas as pd
+
+import history_store
+from history_store import HISTORY_COLUMNS
+
+# =====================
+# 設定
+# =====================
+# 使い方:
+#   python import_history.py legacy_2019.csv legacy_2020.jsonl old_history.xlsx
+# ファイルを少しずつ読み、日時を「%Y/%m/%d %H:%M」にそろえて月ごとに振り分ける。
+# 月ごとのバッファにためてからまとめて追記するので、メモリ使用量は BUFFER_ROWS 程度で頭打ち。
+CHUNK_ROWS = 50000
+BUFFER_ROWS = 200000
+
+
+def _read_chunks(path, chunksize):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        yield from pd.read_csv(path, chunksize=chunksize, dtype=str, encoding="utf-8-sig", keep_default_na=False)
+    elif ext in (".jsonl", ".json"):
+        yield from pd.read_json(path, lines=True, chunksize=chunksize, dtype=False, convert_dates=False)
+    elif ext == ".xlsx":
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True)
+        try:
+            for ws in wb.worksheets:
+                rows = ws.iter_rows(values_only=True)
+                header = next(rows, None)
+                if header is None:
+                    continue
+                header = [str(h) if h is not None else "" for h in header]
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) >= chunksize:
+                        yield pd.DataFrame(batch, columns=header)
+                        batch = []
+                if batch:
+                    yield pd.DataFrame(batch, columns=header)
+        finally:
+            wb.close()
+    else:
+        raise ValueError(f"対応していない形式です: {path}（csv / jsonl / xlsx）")
+
+
+def normalize(chunk):
+    # 列をそろえ、日時を save_history と同じ形式にし、月キーを付ける
+    for c in HISTORY_COLUMNS:
+        if c not in chunk.columns: chunk[c] = ""
+    chunk = chunk[HISTORY_COLUMNS].copy()
+    raw = chunk["日時"].astype("object")
+    dts = pd.to_datetime(raw, errors='coerce', format="mixed")
+    chunk["日時"] = dts.dt.strftime("%Y/%m/%d %H:%M").where(dts.notna(), raw)  # 読めない日時は元の文字列のまま
+    chunk["_key"] = dts.dt.strftime("%Y-%m").where(dts.notna(), "Unknown")
+    return chunk
+
+
+class PartitionBuffer:
+    # 月ごとに行をため、合計が上限を超えたら大きい月から書き出す
+    def __init__(self, limit=BUFFER_ROWS):
+        self.limit = limit
+        self.buffers = {}
+        self.size = 0
+        self.writes = 0
+
+    def add(self, key, rows):
+        self.buffers.setdefault(key, []).extend(rows)
+        self.size += len(rows)
+        while self.size > self.limit:
+            self.flush(max(self.buffers, key=lambda k: len(self.buffers[k])))
+
+    def flush(self, key):
+        rows = self.buffers.pop(key, [])
+        if rows:
+            history_store.append_rows(key, rows)
+            self.size -= len(rows)
+            self.writes += 1
+
+    def flush_all(self):
+        for key in sorted(self.buffers):
+            self.flush(key)
+
+
+def import_files(paths, chunksize=CHUNK_ROWS, buffer_rows=BUFFER_ROWS):
+    buffer = PartitionBuffer(buffer_rows)
+    total = 0
+    for path in paths:
+        for chunk in _read_chunks(path, chunksize):
+            chunk = normalize(chunk)
+            for key, group in chunk.groupby("_key", sort=False):
+                records = group.drop(columns=["_key"]).to_dict("records")
+                buffer.add(key, records)
+            total += len(chunk)
+            print(f"… {path}: 累計 {total} 件")
+    buffer.flush_all()
+    return total, buffer.writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="過去の通話記録（csv / jsonl / xlsx）を一括取り込み")
+    parser.add_argument("files", nargs="+", help="取り込むファイル")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_ROWS, help="1回に読む行数")
+    parser.add_argument("--buffer-rows", type=int, default=BUFFER_ROWS, help="書き出し前にためる最大行数")
+    args = parser.parse_args()
+
+    history_store.get_store()  # 初回は既存の history.xlsx を先に取り込む
+    total, writes = import_files(args.files, args.chunksize, args.buffer_rows)
+    print(f"🎉 完了！ {total} 件を取り込みました（書き込み {writes} 回）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import bisect
+import threading
+import functools
+
+# =====================
+# 計測（処理時間のヒストグラムとカウンター）
+# =====================
+# APP_INSTRUMENTATION=1 で起動時から有効。画面のサイドバー（診断）からも切り替えられる。
+# 無効のときは enabled() を1回見るだけで、計測の処理は何もしない。
+# 値はプロセス全体で共有（すべてのセッション・スレッドの合計）。
+#   with instrumentation.timed("history.load"): ...     ブロックの処理時間
+#   @instrumentation.timed("pdf.render")                関数の処理時間
+#   instrumentation.add("history.bytes_read", n)        カウンター（バイト数・トークン数など）
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+METRIC_PREFIX = "callapp"
+
+_enabled = os.environ.get("APP_INSTRUMENTATION", "0") == "1"
+_lock = threading.Lock()
+_histograms = {}  # name -> {"count", "sum_ms", "max_ms", "buckets": [...]}
+_counters = {}    # name -> 合計値
+_started = time.time()
+
+
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = bool(on)
+
+
+def reset():
+    global _started
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _started = time.time()
+
+
+def observe(name, ms):
+    # 処理時間（ミリ秒）を1件記録する
+    if not _enabled:
+        return
+    with _lock:
+        h = _histograms.get(name)
+        if h is None:
+            h = _histograms[name] = {"count": 0, "sum_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(BUCKETS_MS) + 1)}
+        h["count"] += 1
+        h["sum_ms"] += ms
+        h["max_ms"] = max(h["max_ms"], ms)
+        h["buckets"][bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+
+def add(name, value=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+class timed:
+    # 関数デコレーターとしても with 文としても使える
+    def __init__(self, name):
+        self.name = name
+        self._t0 = threading.local()
+
+    def __enter__(self):
+        self._t0.value = time.perf_counter() if _enabled else None
+        return self
+
+    def __exit__(self, *exc):
+        t0 = getattr(self._t0, "value", None)
+        if t0 is not None:
+            observe(self.name, (time.perf_counter() - t0) * 1000)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(self.name, (time.perf_counter() - t0) * 1000)
+        return wrapper
+
+
+def _quantile(h, q):
+    # バケットの上限で近似した分位点
+    target = h["count"] * q
+    seen = 0
+    for bound, n in zip(BUCKETS_MS + (None,), h["buckets"]):
+        seen += n
+        if seen >= target and n:
+            return h["max_ms"] if bound is None else min(bound, h["max_ms"])
+    return h["max_ms"]
+
+
+def snapshot():
+    # {"enabled", "since", "timings": {名前: {count, mean_ms, p50_ms, p95_ms, max_ms, buckets}}, "counters": {...}}
+    with _lock:
+        timings = {
+            name: {
+                "count": h["count"],
+                "mean_ms": round(h["sum_ms"] / h["count"], 3) if h["count"] else 0.0,
+                "p50_ms": round(_quantile(h, 0.5), 3),
+                "p95_ms": round(_quantile(h, 0.95), 3),
+                "max_ms": round(h["max_ms"], 3),
+                "sum_ms": round(h["sum_ms"], 3),
+                "buckets": dict(zip([str(b) for b in BUCKETS_MS] + ["+Inf"], h["buckets"])),
+            }
+            for name, h in sorted(_histograms.items())
+        }
+        counters = dict(sorted(_counters.items()))
+    return {"enabled": _enabled, "since": _started, "timings": timings, "counters": counters}
+
+
+def to_json():
+    return json.dumps(snapshot(), ensure_ascii=False, indent=1)
+
+
+def _metric_name(name):
+    return METRIC_PREFIX + "_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def to_prometheus():
+    # Prometheus のテキスト形式（ヒストグラムは秒単位）
+    snap = snapshot()
+    lines = []
+    for name, t in snap["timings"].items():
+        metric = _metric_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, n in t["buckets"].items():
+            cumulative += n
+            le = "+Inf" if bound == "+Inf" else repr(int(bound) / 1000)
+            lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{metric}_sum {t['sum_ms'] / 1000}")
+        lines.append(f"{metric}_count {t['count']}")
+    for name, value in snap["counters"].items():
+        metric = _metric_name(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,32 @@
+import re
+import pandas as pd
+
+import instrumentation
+
+# =====================
+# ローカルキーワード集計
+# =====================
+# 形態素解析器を使わず、文字種の連続（カタカナ語・漢字熟語・英数字の製品名など）を
+# 名詞候補として数える。AIプロンプトと同じく日時や一般的な語は除外する。
+STOP_WORDS = [
+    "お願いします", "お願い", "明日", "今日", "本日", "昨日", "先日", "今週", "来週", "先週",
+    "今月", "来月", "先月", "午前", "午後", "日時", "電話", "連絡", "対応", "確認", "様子", "次第", "予定",
+]
+TERM_PATTERN = r"[ァ-ヴー]{2,}|[一-龥々〆ヶ]{2,}|[A-Za-z][A-Za-z0-9\-]+"
+_STOP_PATTERN = "|".join(re.escape(w) for w in sorted(STOP_WORDS, key=len, reverse=True))
+
+
+@instrumentation.timed("keywords.extract")
+def extract_keywords(memo_list, top_n=10):
+    # AIキーワード抽出と同じ「キーワード,回数」の DataFrame を返す
+    memos = pd.Series(memo_list, dtype="object").dropna().astype(str)
+    if memos.empty:
+        return pd.DataFrame(columns=["キーワード", "回数"])
+    # 同じ文面のメモは1回だけ解析し、件数で重み付けする
+    uniq = memos.value_counts()
+    terms = uniq.index.to_series().str.replace(_STOP_PATTERN, " ", regex=True).str.findall(TERM_PATTERN)
+    exploded = pd.DataFrame({"キーワード": terms.values, "回数": uniq.values}).explode("キーワード").dropna()
+    if exploded.empty:
+        return pd.DataFrame(columns=["キーワード", "回数"])
+    counts = exploded.groupby("キーワード", sort=False)["回数"].sum().sort_values(ascending=False, kind="stable")
+    return counts.head(top_n).reset_index()
@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import uuid
+import smtplib
+import threading
+from email.mime.text import MIMEText
+from email.utils import formatdate
+
+import write_queue
+import instrumentation
+
+# =====================
+# 送信キュー設定
+# =====================
+# ローカル検証用: SMTP_HOST=localhost SMTP_PORT=8025 SMTP_TLS=0
+# （python -m aiosmtpd -n -l localhost:8025 など。TLS無しのときはログインもしない）
+OUTBOX_DIR = "outbox"
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
+SMTP_TLS = os.environ.get("SMTP_TLS", "1") == "1"
+SMTP_TIMEOUT = 20
+MAX_ATTEMPTS = 6
+RETRY_BASE_SEC = 5       # 5, 10, 20, 40... 秒後に再送
+RETRY_MAX_SEC = 600
+IDLE_CLOSE_SEC = 60      # この時間送信がなければ接続を閉じる
+SENT_RETENTION_SEC = 7 * 24 * 3600
+FULL_SCAN_SEC = 600      # この間隔で送信箱を全部読み直す（他のプロセスが同じ送信箱に積んだメールも拾う）
+# まとめ送信（ダイジェスト）: 同じ宛先へのメールを一定時間ためて1通にする
+DIGEST_WINDOW_SEC = int(os.environ.get("MAIL_DIGEST_WINDOW_SEC", "300"))
+URGENT_REQUESTS = ("緊急対応", "折り返しのお願い")  # ダイジェスト中でも即時送信
+
+# パスワードはディスクに書かず、プロセス内だけで保持する
+# （再起動後の未送信メールは、同じ送信元から次の送信があった時点で再開）
+_credentials = {}
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = None
+# 送信箱の状態の一覧（書き込みのたびに更新する）。画面の件数表示と送信ワーカーの見回りはこれを使い、
+# 送信箱のファイルは送る直前のメールだけを読む
+_status_lock = threading.Lock()
+_status_index = None  # msg_id -> INDEX_FIELDS
+INDEX_FIELDS = ("status", "created", "next_try", "sent_at", "digest", "from", "to", "cc", "subject", "last_error")
+
+
+def _path(msg_id):
+    return os.path.join(OUTBOX_DIR, f"{msg_id}.json")
+
+
+def _index_entry(msg):
+    return {k: msg.get(k) for k in INDEX_FIELDS}
+
+
+def _write(msg):
+    os.makedirs(OUTBOX_DIR, exist_ok=True)
+    with write_queue.atomic_write(_path(msg["id"]), "w", encoding="utf-8") as f:
+        json.dump(msg, f, ensure_ascii=False)
+    with _status_lock:
+        if _status_index is not None:
+            _status_index[msg["id"]] = _index_entry(msg)
+
+
+def _remove(msg_id):
+    os.remove(_path(msg_id))
+    with _status_lock:
+        if _status_index is not None:
+            _status_index.pop(msg_id, None)
+
+
+def _read(msg_id):
+    try:
+        with open(_path(msg_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _all_messages():
+    # 送信箱を全部読み、状態の一覧も作り直す
+    # （読んでいる間の _write が一覧から漏れないよう、一覧のロックを持ったまま読む）
+    global _status_index
+    msgs = []
+    with _status_lock:
+        for name in os.listdir(OUTBOX_DIR) if os.path.isdir(OUTBOX_DIR) else []:
+            if name.endswith(".json"):
+                msg = _read(name[:-5])
+                if msg: msgs.append(msg)
+        _status_index = {m["id"]: _index_entry(m) for m in msgs}
+    return msgs
+
+
+def _indexed(status):
+    # 状態の一覧から status のものを [(msg_id, 一覧の値), ...] で返す
+    with _status_lock:
+        return [(i, dict(e)) for i, e in (_status_index or {}).items() if e["status"] == status]
+
+
+# =====================
+# 公開API
+# =====================
+def enqueue(from_mail, pw, to_mail, cc_mail, subject, body, digest_sec=0):
+    # 送信箱に保存してすぐ戻る。戻り値のIDで status() を確認できる
+    # digest_sec > 0 なら、同じ宛先のメールとまとめて digest_sec 秒後に送る
+    now = time.time()
+    msg = {
+        "id": uuid.uuid4().hex, "from": from_mail, "to": to_mail, "cc": cc_mail or "",
+        "subject": subject, "body": body, "status": "queued", "attempts": 0,
+        "next_try": now + max(0, digest_sec), "last_error": "", "created": now,
+        "digest": digest_sec > 0,
+    }
+    with _lock:
+        _credentials[from_mail] = pw
+        _write(msg)
+    _ensure_worker()
+    _wakeup.set()
+    return msg["id"]
+
+
+def status(msg_id):
+    return _read(msg_id)
+
+
+def summary():
+    # 送信箱のファイルは読まず、メモリ上の状態の一覧から数える（初回だけ送信箱を読む）
+    if _status_index is None:
+        _all_messages()
+    counts = {"queued": 0, "sending": 0, "sent": 0, "failed": 0}
+    failed = []
+    with _status_lock:
+        entries = list((_status_index or {}).values())
+    for msg in entries:
+        counts[msg["status"]] = counts.get(msg["status"], 0) + 1
+        if msg["status"] == "failed": failed.append(msg)
+    failed.sort(key=lambda m: m["created"], reverse=True)
+    return counts, failed
+
+
+# =====================
+# 接続プール（送信元アカウントごとに1接続を使い回す）
+# =====================
+_connections = {}  # from_mail -> [smtp, last_used, opened]
+
+
+@instrumentation.timed("smtp.connect")
+def _connect(from_mail, pw):
+    smtpobj = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    smtpobj.ehlo()
+    if SMTP_TLS:
+        smtpobj.starttls()
+        smtpobj.ehlo()
+        smtpobj.login(from_mail, pw)
+    return smtpobj
+
+
+def _get_connection(from_mail, pw):
+    conn = _connections.get(from_mail)
+    if conn is not None:
+        try:
+            if conn[0].noop()[0] == 250:
+                return conn[0]
+        except smtplib.SMTPException:
+            pass
+        except OSError:
+            pass
+        _drop_connection(from_mail)
+    smtpobj = _connect(from_mail, pw)
+    _connections[from_mail] = [smtpobj, time.time(), time.time()]
+    return smtpobj
+
+
+def _drop_connection(from_mail):
+    conn = _connections.pop(from_mail, None)
+    if conn is not None:
+        instrumentation.observe("smtp.session", (time.time() - conn[2]) * 1000)  # 接続してから閉じるまで
+        try:
+            conn[0].quit()
+        except Exception:
+            conn[0].close()
+
+
+def _close_idle():
+    now = time.time()
+    for from_mail in [k for k, c in _connections.items() if now - c[1] > IDLE_CLOSE_SEC]:
+        _drop_connection(from_mail)
+
+
+# =====================
+# 送信ワーカー
+# =====================
+def _build(msg):
+    mime = MIMEText(msg["body"])
+    mime['Subject'] = msg["subject"]
+    mime['From'] = msg["from"]
+    mime['To'] = msg["to"]
+    mime['Cc'] = msg["cc"]
+    mime['Date'] = formatdate()
+    recipients = [msg["to"]]
+    if msg["cc"]: recipients.append(msg["cc"])
+    return mime, recipients
+
+
+def _digest_key(msg):
+    return (msg["from"], msg["to"], msg["cc"])
+
+
+def _merge(group):
+    # 複数のメールを1通にまとめる（1通だけならそのまま）
+    if len(group) == 1:
+        return group[0]
+    head = group[0]
+    body = "\n\n----------\n\n".join(f"■ {m['subject']}\n{m['body']}" for m in group)
+    return dict(head, subject=f"{head['subject']}（他{len(group) - 1}件）", body=body)
+
+
+def _digest_group(msg):
+    # 同じ宛先でまとめ待ちのメール（状態の一覧から探し、本文は送信箱から読む）
+    ids = sorted((e["created"], i) for i, e in _indexed("queued")
+                 if i != msg["id"] and e["digest"] and _digest_key(e) == _digest_key(msg))
+    return [m for m in (_read(i) for _, i in ids) if m and m["status"] == "queued"]
+
+
+def _deliver(msg):
+    # 同じ宛先でまとめ待ちのメールがあれば、一緒に1通で送る
+    pw = _credentials.get(msg["from"])
+    if pw is None:
+        return False  # パスワード不明。次に同じ送信元が登録されるまで待機
+    group = [msg] + _digest_group(msg)
+    for m in group:
+        m["status"] = "sending"
+        m["attempts"] += 1
+        _write(m)
+    try:
+        mime, recipients = _build(_merge(group))
+        smtpobj = _get_connection(msg["from"], pw)
+        with instrumentation.timed("smtp.send"):
+            smtpobj.sendmail(msg["from"], recipients, mime.as_string())
+        instrumentation.add("smtp.messages", len(group))
+        _connections[msg["from"]][1] = time.time()
+        for m in group:
+            m["status"] = "sent"
+            m["sent_at"] = time.time()
+            m["last_error"] = ""
+            m["batch_size"] = len(group)
+    except smtplib.SMTPAuthenticationError as e:
+        _drop_connection(msg["from"])
+        for m in group:
+            m["status"] = "failed"
+            m["last_error"] = f"認証エラー: {e}"
+    except Exception as e:
+        _drop_connection(msg["from"])
+        for m in group:
+            m["last_error"] = str(e)
+            if m["attempts"] >= MAX_ATTEMPTS:
+                m["status"] = "failed"
+            else:
+                m["status"] = "queued"
+                m["next_try"] = time.time() + min(RETRY_BASE_SEC * 2 ** (m["attempts"] - 1), RETRY_MAX_SEC)
+    for m in group:
+        _write(m)
+    return True
+
+
+def _run():
+    # 起動時と FULL_SCAN_SEC ごとだけ送信箱を全部読み、それ以外は状態の一覧で見回る
+    # 前回の停止時に送信中だったものは未送信に戻す
+    for msg in _all_messages():
+        if msg["status"] == "sending":
+            msg["status"] = "queued"
+            _write(msg)
+    last_scan = time.time()
+    while True:
+        _wakeup.clear()
+        now = time.time()
+        next_due = now + IDLE_CLOSE_SEC
+        try:
+            if now - last_scan > FULL_SCAN_SEC:
+                _all_messages()
+                last_scan = now
+            # 期限の来たものから送る（即時送信のメールが、まとめ待ちの同じ宛先のメールを連れて行く）
+            for msg_id, ent in sorted(_indexed("queued"), key=lambda x: x[1]["next_try"]):
+                if ent["next_try"] > now:
+                    next_due = min(next_due, ent["next_try"])
+                    continue
+                msg = _read(msg_id)  # 先に同じ宛先のメールと一緒に送ったものは、ここで送信済みになっている
+                if msg is None or msg["status"] != "queued":
+                    continue
+                if not _deliver(msg):
+                    continue
+                if msg["status"] == "queued":
+                    next_due = min(next_due, msg["next_try"])
+            for msg_id, ent in _indexed("sent"):
+                if now - (ent["sent_at"] or now) > SENT_RETENTION_SEC:
+                    _remove(msg_id)
+            _close_idle()
+        except Exception:
+            next_due = now + RETRY_BASE_SEC  # 送信箱の読み書きエラーなどは少し待って再試行
+        _wakeup.wait(max(0.0, next_due - time.time()))
+
+
+def _ensure_worker():
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="mail-queue", daemon=True)
+            _worker.start()
@@ -1,23 +1,24 @@
+import time
+# 画面1回分（Streamlit の再実行）の処理時間を計測。モジュールの読み込みは初回だけなので、
+# APP_INSTRUMENTATION=1 で起動すると最初の1回が起動時間になる
+_rerun_t0 = time.perf_counter()
 import streamlit as st
-import pandas as pd
 import datetime
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.utils import formatdate
 import re
-from groq import Client
-import io
-
-# PDF生成用ライブラリ
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.cidfonts import UnicodeCIDFont
-from reportlab.lib.units import mm
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib import colors
+import tempfile
+import concurrent.futures
+import history_store
+import search_index
+import caller_lookup
+import employee_directory
+import mail_queue
+import ai_analysis
+import keywords
+import pdf_report
+import export_history
+import analytics
+import instrumentation
 
 # ==========================================
 # ⚙️ 【重要】共有アカウント設定
@@ -113,246 +114,64 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# =====================
-# ファイル設定（Excel）
-# =====================
-DATA_FILE = "history.xlsx"
-EMPLOYEE_FILE = "employees.csv"
-
 # =====================
 # 関数定義
 # =====================
 
-# 1. 安全な履歴読み込み
-def safe_load_history():
-    cols = ["日時", "From", "To", "CC", "相手", "電話番号", "用件", "詳細"]
-    if not os.path.exists(DATA_FILE):
-        return pd.DataFrame(columns=cols)
-    try:
-        all_sheets = pd.read_excel(DATA_FILE, sheet_name=None, engine="openpyxl")
-        if not all_sheets:
-            return pd.DataFrame(columns=cols)
-        df_combined = pd.concat(all_sheets.values(), ignore_index=True)
-        for c in cols:
-            if c not in df_combined.columns: df_combined[c] = ""
-        if "日時" in df_combined.columns:
-            df_combined["datetime"] = pd.to_datetime(df_combined["日時"], errors='coerce')
-            df_combined = df_combined.sort_values("datetime", ascending=False).drop(columns=["datetime"])
-        return df_combined
-    except Exception as e:
-        return pd.DataFrame(columns=cols)
+# 1. 安全な履歴読み込み（保存形式・キャッシュは history_store.py）
+def safe_load_history(columns=None, partitions=None):
+    return history_store.safe_load_history(columns, partitions)
 
-# 2. 履歴保存
+# 2. 履歴保存（書き込みキューに積んですぐ戻る。月ごとのファイルへの追記は書き込みスレッドが順番に行う）
+SAVE_WAIT_SEC = 5  # 画面で書き込みの完了を待つ上限（超えたらサイドバーで結果を知らせる）
+
+@instrumentation.timed("app.save_history")
 def save_history(dt, f, t, c, caller, tel, req, memo):
-    new_row = pd.DataFrame({
-        "日時":[dt], "From":[f], "To":[t], "CC":[c],
-        "相手":[caller], "電話番号":[tel], "用件":[req], "詳細":[memo]
-    })
-    
+    return history_store.save_history(dt, f, t, c, caller, tel, req, memo)
+
+def wait_saved(future, timeout=SAVE_WAIT_SEC):
+    # 戻り値: ("saved" | "pending" | "failed", 例外)
     try:
-        date_obj = pd.to_datetime(dt)
-        sheet_name = date_obj.strftime("%Y-%m")
-    except:
-        sheet_name = "Unknown"
-
-    if not os.path.exists(DATA_FILE):
-        with pd.ExcelWriter(DATA_FILE, engine="openpyxl") as writer:
-            new_row.to_excel(writer, sheet_name=sheet_name, index=False)
-    else:
-        try:
-            existing_df = pd.read_excel(DATA_FILE, sheet_name=sheet_name, engine="openpyxl")
-            updated_df = pd.concat([existing_df, new_row], ignore_index=True)
-        except:
-            updated_df = new_row
-            
-        with pd.ExcelWriter(DATA_FILE, mode='a', engine="openpyxl", if_sheet_exists='replace') as writer:
-            updated_df.to_excel(writer, sheet_name=sheet_name, index=False)
+        future.result(timeout=timeout)
+        return "saved", None
+    except concurrent.futures.TimeoutError:
+        return "pending", None
+    except Exception as e:
+        return "failed", e
 
-# 3. 従業員管理
+# 3. 従業員管理（ID・名前・メールの索引つきでプロセス内に保持。処理本体は employee_directory.py）
 def load_employees():
-    if os.path.exists(EMPLOYEE_FILE):
-        return pd.read_csv(EMPLOYEE_FILE)
-    else:
-        df = pd.DataFrame({"名前":["田中課長"], "メール":["tanaka@test.com"]})
-        df.to_csv(EMPLOYEE_FILE, index=False, encoding="utf-8-sig")
-        return df
+    return employee_directory.load()
 
 def save_employee(name, email):
-    new_data = pd.DataFrame({"名前":[name], "メール":[email]})
-    new_data.to_csv(EMPLOYEE_FILE, mode='a', header=not os.path.exists(EMPLOYEE_FILE), index=False, encoding="utf-8-sig")
+    return employee_directory.add(name, email)
 
-def delete_employee(name_to_delete):
-    df = load_employees()
-    df = df[df["名前"] != name_to_delete]
-    df.to_csv(EMPLOYEE_FILE, index=False, encoding="utf-8-sig")
+def delete_employee(emp_id):
+    employee_directory.delete(emp_id)
 
-# 4. メール送信
-def send_gmail(from_mail, pw, to_mail, cc_mail, subject, body):
+# 4. メール送信（送信キューに登録してすぐ戻る。実際の送信は mail_queue.py のワーカー）
+@instrumentation.timed("app.send_gmail")
+def send_gmail(from_mail, pw, to_mail, cc_mail, subject, body, digest_sec=0):
     if not pw:
         st.error("⚠️ メール設定（パスワード）がされていません")
-        return False
+        return None
     try:
-        msg = MIMEText(body)
-        msg['Subject'] = subject
-        msg['From'] = from_mail
-        msg['To'] = to_mail
-        msg['Cc'] = cc_mail
-        msg['Date'] = formatdate()
-        recipients = [to_mail]
-        if cc_mail: recipients.append(cc_mail)
-        smtpobj = smtplib.SMTP('smtp.gmail.com', 587)
-        smtpobj.ehlo()
-        smtpobj.starttls()
-        smtpobj.login(from_mail, pw)
-        smtpobj.sendmail(from_mail, recipients, msg.as_string())
-        smtpobj.close()
-        return True
+        return mail_queue.enqueue(from_mail, pw, to_mail, cc_mail, subject, body, digest_sec)
     except Exception as e:
         st.error(f"送信エラー: {e}")
-        return False
-
-# 5. Groq AI分析
-def analyze_with_groq(api_key, memo_list, period_label):
-    if not api_key: return "⚠️ Groq APIキーを設定してください"
-    
-    all_text = "\n".join(memo_list)
-    if len(all_text) > 6000:
-        return "⚠️ データ量が多すぎてTOKENが足りません。\n期間を絞って再実行してください。"
-
-    try:
-        client = Client(api_key=api_key)
-        prompt = f"""
-        あなたはデータアナリストです。
-        対象期間: 【{period_label}】
-        以下の電話メモデータを分析し、日本語でレポートを作成してください。
-        
-        【指示】
-        - 「明日」「今日」「電話」「お願いします」などの一般的な単語は分析対象から外してください。
-        - 業務上の具体的な課題や、頻出する固有名詞に着目してください。
-
-        【フォーマット】
-        1. 頻出トピック (3つ)
-        2. 傾向の要約 (200文字以内)
-        3. 業務改善アドバイス
-        
-        [データ]
-        {all_text}
-        """
-        completion = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.5, max_tokens=1000
-        )
-        return completion.choices[0].message.content
-    except Exception as e:
-        err_msg = str(e)
-        if "rate_limit_exceeded" in err_msg or "413" in err_msg or "429" in err_msg:
-             return "⚠️ データ量が多すぎてTOKENが足りません（API制限）。\n期間を絞ってください。"
-        return f"エラー: {e}"
-
-# 6. AIキーワード抽出
-def extract_keywords_ai(api_key, memo_list):
-    if not api_key: return None
-    all_text = "\n".join(memo_list)
-    if len(all_text) > 6000:
-        st.error("⚠️ データ量が多すぎてTOKENが足りません。期間を絞ってください。")
         return None
 
-    try:
-        client = Client(api_key=api_key)
-        prompt = f"""
-        以下の電話メモから、業務上重要な「キーワード」をトップ10抽出し、その出現回数をカウントしてください。
-        【除外ルール】日時、一般的な動詞（電話、連絡、対応など）は除外。名詞を優先。
-        【出力】CSV形式（ヘッダー：キーワード,回数）のみ。余計な文字禁止。
-        [データ]
-        {all_text}
-        """
-        completion = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.0, max_tokens=200
-        )
-        content = completion.choices[0].message.content
-        content = content.replace("```csv", "").replace("```", "").strip()
-        clean_lines = [line.strip() for line in content.split('\n') if "," in line and len(line) < 50]
-        clean_content = "\n".join(clean_lines)
-        if not clean_content: return None
-        df_kw = pd.read_csv(io.StringIO(clean_content), on_bad_lines='skip')
-        if len(df_kw.columns) >= 2: df_kw.columns = ["キーワード", "回数"]
-        return df_kw
-    except Exception as e:
-        err_msg = str(e)
-        if "rate_limit_exceeded" in err_msg or "413" in err_msg or "429" in err_msg:
-             st.error("⚠️ データ量が多すぎてTOKENが足りません（API制限）。期間を絞ってください。")
-        else:
-             st.error(f"AIキーワード抽出エラー: {e}")
-        return None
+# 5. Groq AI分析（月別サマリーを年・全期間へ統合。処理本体は ai_analysis.py）
+def analyze_with_groq(api_key, memos_by_month, period_label):
+    return ai_analysis.analyze_with_groq(api_key, memos_by_month, period_label)
 
-# 7. PDF生成
-def create_pdf_report(report_text, period_label, caller_df, keyword_df):
-    buffer = io.BytesIO()
-    pdfmetrics.registerFont(UnicodeCIDFont('HeiseiKakuGo-W5'))
-    
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    styles = getSampleStyleSheet()
-    style_jp = styles["Normal"]
-    style_jp.fontName = "HeiseiKakuGo-W5"
-    style_jp.fontSize = 10
-    style_jp.leading = 14
-    style_title = styles["Title"]
-    style_title.fontName = "HeiseiKakuGo-W5"
-    style_h2 = styles["Heading2"]
-    style_h2.fontName = "HeiseiKakuGo-W5"
-    
-    story = []
-    story.append(Paragraph(f"電話対応分析レポート ({period_label})", style_title))
-    story.append(Spacer(1, 10*mm))
-    story.append(Paragraph("【AI分析サマリー】", style_h2))
-    
-    if "TOKENが足りません" in report_text:
-        story.append(Paragraph(report_text, style_jp))
-    else:
-        for line in report_text.split('\n'):
-            if line.strip() == "": story.append(Spacer(1, 2*mm))
-            else: story.append(Paragraph(line, style_jp))
-            
-    story.append(Spacer(1, 10*mm))
-    
-    if not caller_df.empty:
-        story.append(Paragraph("【相手先件数（TOP10）】", style_h2))
-        story.append(Spacer(1, 3*mm))
-        table_data = [['順位', '相手先名', '件数']]
-        top10 = caller_df.head(10)
-        for idx, (name, count) in enumerate(top10.items(), 1):
-            table_data.append([str(idx), str(name), str(count)])
-        t = Table(table_data, colWidths=[20*mm, 90*mm, 30*mm])
-        t.setStyle(TableStyle([
-            ('FONT', (0,0), (-1,-1), 'HeiseiKakuGo-W5'),
-            ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-            ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-        ]))
-        story.append(t)
-        story.append(Spacer(1, 10*mm))
-
-    if keyword_df is not None and not keyword_df.empty:
-        story.append(Paragraph("【頻出キーワード（AI抽出）】", style_h2))
-        story.append(Spacer(1, 3*mm))
-        table_data_kw = [['キーワード', '回数']]
-        for index, row in keyword_df.iterrows():
-            table_data_kw.append([str(row.iloc[0]), str(row.iloc[1])])
-        t_kw = Table(table_data_kw, colWidths=[90*mm, 30*mm])
-        t_kw.setStyle(TableStyle([
-            ('FONT', (0,0), (-1,-1), 'HeiseiKakuGo-W5'),
-            ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-            ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-        ]))
-        story.append(t_kw)
-
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
+# 6. キーワード抽出（LLMを使わずローカルで集計。処理本体は keywords.py）
+def extract_keywords_local(memo_list):
+    return keywords.extract_keywords(memo_list)
+
+# 7. PDF生成（フォント登録は1回だけ、同じ内容なら作成済みのPDFを再利用。処理本体は pdf_report.py）
+def create_pdf_report(report_text, period_label, caller_df, keyword_df, summary=None):
+    return pdf_report.create_pdf_report(report_text, period_label, caller_df, keyword_df, summary)
 
 # =====================
 # コールバック
@@ -364,6 +183,15 @@ def fix_name_callback():
         if current_name and not any(current_name.endswith(h) for h in honorifics):
             st.session_state.input_name_val = current_name + "様"
 
+def toggle_diagnostics_callback():
+    instrumentation.enable(st.session_state.diag_enabled)
+
+def pick_caller_callback(name, tel):
+    # 過去の相手先の候補から選んだら、名前と電話番号を入力欄に入れる
+    st.session_state.input_name_val = name
+    st.session_state.input_tel_val = tel
+    st.session_state.caller_lookup = ""
+
 # =====================
 # メイン画面
 # =====================
@@ -391,234 +219,381 @@ with st.sidebar:
     else:
         groq_key = st.text_input("Groq API Key", type="password")
 
-tab1, tab2, tab3 = st.tabs(["📝 電話入力", "👥 アドレス帳", "📊 データ分析"])
+    st.divider()
+    # 直前に登録した履歴の書き込み結果（画面で待ちきれなかったとき・失敗したときの確認用）
+    last_save = st.session_state.get("last_save")
+    if last_save:
+        save_state, save_error = wait_saved(last_save["future"], timeout=0)
+        if save_state == "saved":
+            st.success(f"✅ 直前の履歴: 保存済み（{last_save['dt']} {last_save['name']}）")
+        elif save_state == "failed":
+            st.error(f"⚠️ 直前の履歴: 保存失敗（{last_save['dt']} {last_save['name']}）{save_error}")
+        else:
+            st.info(f"⏳ 直前の履歴: 書き込み中（{last_save['dt']} {last_save['name']}）")
+    st.subheader("📮 メール送信状況")
+    use_digest = st.checkbox("まとめ送信（同じ担当者へのメールを1通に）", help="「緊急対応」「折り返しのお願い」は待たずに即時送信します")
+    digest_min = st.number_input("まとめる間隔（分）", 1, 60, max(1, min(60, mail_queue.DIGEST_WINDOW_SEC // 60)), disabled=not use_digest)
+    mail_counts, mail_failed = mail_queue.summary()
+    st.caption(f"送信待ち {mail_counts['queued'] + mail_counts['sending']} 件 / 送信済み {mail_counts['sent']} 件 / 失敗 {mail_counts['failed']} 件")
+    last_mail = mail_queue.status(st.session_state["last_mail_id"]) if "last_mail_id" in st.session_state else None
+    if last_mail:
+        if last_mail["status"] == "sent":
+            st.success(f"✅ 直前のメール: 送信済み（{last_mail['to']}）")
+        elif last_mail["status"] == "failed":
+            st.error(f"⚠️ 直前のメール: 送信失敗 {last_mail['last_error']}")
+        else:
+            st.info(f"⏳ 直前のメール: 送信待ち（試行 {last_mail['attempts']} 回）")
+    for m in mail_failed[:3]:
+        st.warning(f"失敗: {m['subject']} → {m['to']}\n{m['last_error']}")
+    if st.button("🔄 状況を更新"):
+        st.rerun()
+
+    st.divider()
+    # 処理時間の計測（サーバー全体で共有。処理本体は instrumentation.py）
+    with st.expander("🩺 診断（処理時間）"):
+        st.checkbox("計測する", value=instrumentation.enabled(), key="diag_enabled", on_change=toggle_diagnostics_callback)
+        diag = instrumentation.snapshot()
+        if diag["timings"]:
+            st.dataframe(
+                [{"処理": name, "回数": t["count"], "平均ms": t["mean_ms"], "p95ms": t["p95_ms"], "最大ms": t["max_ms"]}
+                 for name, t in diag["timings"].items()],
+                use_container_width=True, hide_index=True
+            )
+        if diag["counters"]:
+            st.dataframe([{"項目": name, "値": v} for name, v in diag["counters"].items()],
+                         use_container_width=True, hide_index=True)
+        d1, d2 = st.columns(2)
+        with d1:
+            st.download_button("JSON", instrumentation.to_json(), file_name="metrics.json", mime="application/json")
+        with d2:
+            st.download_button("Prometheus", instrumentation.to_prometheus(), file_name="metrics.prom", mime="text/plain")
+        if st.button("計測値をリセット"):
+            instrumentation.reset()
+            st.rerun()
+
+# タブを切り替えたときに再実行し、開いているタブの中身だけを実行する（tab.open）
+# （入力フォームの操作で分析タブの読み込み・集計が走らない）
+# 描画されなかったウィジェットの値は Streamlit が消してしまうので、入力途中の値は Session State に残しておく
+# （通話中にアドレス帳を見てから戻っても、入力中の相手先や検索語がそのまま残る）
+VIEWS = ["📝 電話入力", "👥 アドレス帳", "📊 データ分析"]
+KEEP_KEYS = ["view", "caller_lookup", "input_from", "input_to", "input_cc", "input_name_val", "input_tel_val",
+             "input_req", "input_subject", "input_memo",
+             "search_query", "export_start", "export_end", "export_fmt", "export_reqs", "export_query"]
+for k in KEEP_KEYS:
+    if k in st.session_state:
+        st.session_state[k] = st.session_state[k]
+tab1, tab2, tab3 = st.tabs(VIEWS, key="view", on_change="rerun")
 
 # --- TAB1: 入力 ---
 with tab1:
-    emp_df = load_employees()
-    emp_options = ["---"] + [f"{row['名前']} : {row['メール']}" for _, row in emp_df.iterrows()]
-    if "input_name_val" not in st.session_state: st.session_state.input_name_val = ""
-
-    with st.container(border=True):
-        st.subheader("新規登録")
-        with st.form("input_form", clear_on_submit=False):
-            # 1. From等
-            c_f, c_t, c_c = st.columns(3)
-            with c_f: from_sel = st.selectbox("From (受付)", emp_options)
-            with c_t: to_sel = st.selectbox("To (担当)", emp_options)
-            with c_c: cc_sel = st.selectbox("CC (共有)", ["---"] + [x for x in emp_options if x != "---"])
+    if tab1.open:
+        # 選択肢は従業員ID（None は未選択）。表示名は索引から引くだけで、CSVの再読み込みや文字列分割はしない
+        emp_ids = employee_directory.ids()
+        emp_labels = employee_directory.labels()
+        emp_options = [None] + emp_ids
+        emp_format = lambda emp_id: emp_labels.get(emp_id, "---")
+        if "input_name_val" not in st.session_state: st.session_state.input_name_val = ""
+        if "input_tel_val" not in st.session_state: st.session_state.input_tel_val = ""
+        # 残しておいた従業員が削除されていたら未選択に戻す
+        for k in ("input_from", "input_to", "input_cc"):
+            if st.session_state.get(k) not in emp_options: st.session_state.pop(k, None)
+
+        with st.container(border=True):
+            st.subheader("新規登録")
+            # 過去の相手先から選ぶと、下の名前・電話番号に入る（フォームの外なので入力すると候補が更新される。処理本体は caller_lookup.py）
+            lookup_q = st.text_input("🔎 過去の相手先を検索（名前・会社名の先頭 / 電話番号）", key="caller_lookup", placeholder="例：山田 / 090")
+            for i, cand in enumerate(caller_lookup.lookup(lookup_q)):
+                c_pick, c_recent = st.columns([2, 3])
+                with c_pick:
+                    st.button(f"{cand['相手']}（{cand['電話番号'] or '番号なし'}）", key=f"caller_pick_{i}",
+                              on_click=pick_caller_callback, args=(cand["相手"], cand["電話番号"]))
+                with c_recent:
+                    recent = " / ".join(f"{r['日時']} {r['用件']}：{r['詳細']}" for r in cand["recent"])
+                    st.caption(f"{cand['count']} 件　{recent}")
+            with st.form("input_form", clear_on_submit=False):
+                # 1. From等
+                c_f, c_t, c_c = st.columns(3)
+                with c_f: from_sel = st.selectbox("From (受付)", emp_options, format_func=emp_format, key="input_from")
+                with c_t: to_sel = st.selectbox("To (担当)", emp_options, format_func=emp_format, key="input_to")
+                with c_c: cc_sel = st.selectbox("CC (共有)", emp_options, format_func=emp_format, key="input_cc")
             
-            st.divider()
+                st.divider()
 
-            # 2. 相手の名前等
-            c1, c2 = st.columns(2)
-            with c1: in_name = st.text_input("相手の名前 / 会社名", key="input_name_val", placeholder="例：田中")
-            with c2: in_tel = st.text_input("電話番号")
+                # 2. 相手の名前等
+                c1, c2 = st.columns(2)
+                with c1: in_name = st.text_input("相手の名前 / 会社名", key="input_name_val", placeholder="例：田中")
+                with c2: in_tel = st.text_input("電話番号", key="input_tel_val")
             
-            st.divider()
-
-            # 3. 日付等
-            c_date, c_time = st.columns(2)
-            with c_date:
-                in_date = st.date_input("日付", datetime.datetime.now())
-            with c_time:
-                in_time = st.time_input("時間", datetime.datetime.now())
+                st.divider()
+
+                # 3. 日付等
+                c_date, c_time = st.columns(2)
+                with c_date:
+                    in_date = st.date_input("日付", datetime.datetime.now())
+                with c_time:
+                    in_time = st.time_input("時間", datetime.datetime.now())
             
-            # 4. 対応
-            req_options = ["---", "伝言のみ", "折り返しのお願い", "また電話します","お問い合わせ", "その他"]
-            in_req = st.selectbox("対応", req_options)
+                # 4. 対応
+                req_options = ["---", "伝言のみ", "折り返しのお願い", "また電話します","お問い合わせ", "その他"]
+                in_req = st.selectbox("対応", req_options, key="input_req")
 
-            # 5. メール件名
-            in_subject = st.text_input("メール件名（空欄の場合は自動生成）", placeholder="例：【至急】田中様より 折り返しのお願い")
+                # 5. メール件名
+                in_subject = st.text_input("メール件名（空欄の場合は自動生成）", placeholder="例：【至急】田中様より 折り返しのお願い", key="input_subject")
             
-            # 6. 詳細メモ
-            in_memo = st.text_area("詳細メモ", height=100)
+                # 6. 詳細メモ
+                in_memo = st.text_area("詳細メモ", height=100, key="input_memo")
 
-            # 7. 送信ボタン
-            submitted = st.form_submit_button("送信＆保存", on_click=fix_name_callback)
+                # 7. 送信ボタン
+                submitted = st.form_submit_button("送信＆保存", on_click=fix_name_callback)
             
-            if submitted:
-                if from_sel == "---" or to_sel == "---":
-                    st.error("⚠️ From と To を選択してください")
-                elif in_req == "---":
-                    st.error("⚠️ 用件を選択してください")
-                elif not in_name:
-                    st.warning("⚠️ 相手の名前を入力してください")
-                else:
-                    final_name = st.session_state.input_name_val
+                if submitted:
+                    if from_sel is None or to_sel is None:
+                        st.error("⚠️ From と To を選択してください")
+                    elif in_req == "---":
+                        st.error("⚠️ 用件を選択してください")
+                    elif not in_name:
+                        st.warning("⚠️ 相手の名前を入力してください")
+                    else:
+                        final_name = st.session_state.input_name_val
                     
-                    # 日付と時間を結合
-                    dt_obj = datetime.datetime.combine(in_date, in_time)
-                    input_dt_str = dt_obj.strftime("%Y/%m/%d %H:%M")
+                        # 日付と時間を結合
+                        dt_obj = datetime.datetime.combine(in_date, in_time)
+                        input_dt_str = dt_obj.strftime("%Y/%m/%d %H:%M")
                     
-                    f_val = from_sel.split(" : ")
-                    t_val = to_sel.split(" : ")
-                    f_mail, f_name = f_val[1], f_val[0]
-                    t_mail, t_name = t_val[1], t_val[0]
-                    c_mail, c_name = "", ""
-                    if cc_sel != "---":
-                        c_val = cc_sel.split(" : ")
-                        c_mail, c_name = c_val[1], c_val[0]
+                        f_emp = employee_directory.get(from_sel) or {"名前": "", "メール": ""}
+                        t_emp = employee_directory.get(to_sel) or {"名前": "", "メール": ""}
+                        f_mail, f_name = f_emp["メール"], f_emp["名前"]
+                        t_mail, t_name = t_emp["メール"], t_emp["名前"]
+                        c_mail, c_name = "", ""
+                        if cc_sel is not None:
+                            c_emp = employee_directory.get(cc_sel)
+                            if c_emp: c_mail, c_name = c_emp["メール"], c_emp["名前"]
                     
-                    save_history(input_dt_str, f_name, t_name, c_name, final_name, in_tel, in_req, in_memo)
+                        # 書き込みが終わるまで少し待ち、書けたことを確かめてから完了と表示する
+                        save_future = save_history(input_dt_str, f_name, t_name, c_name, final_name, in_tel, in_req, in_memo)
+                        st.session_state["last_save"] = {"future": save_future, "dt": input_dt_str, "name": final_name}
+                        save_state, save_error = wait_saved(save_future)
                     
-                    if in_subject.strip(): subject = in_subject
-                    else: subject = f"【電話】{final_name}"
+                        if in_subject.strip(): subject = in_subject
+                        else: subject = f"【電話】{final_name}"
                     
-                    body = f"{t_name}さん\n\nお電話がありました。\n日時: {input_dt_str}\n相手: {final_name} ({in_tel})\n用件: {in_req}\n\n詳細:\n{in_memo}"
+                        body = f"{t_name}さん\n\nお電話がありました。\n日時: {input_dt_str}\n相手: {final_name} ({in_tel})\n用件: {in_req}\n\n詳細:\n{in_memo}"
                     
-                    if send_gmail(my_email, my_pass, t_mail, c_mail, subject, body):
-                        st.success(f"✅ 送信完了！ 日時：{input_dt_str} で登録しました。")
-                    else:
-                        st.success(f"✅ 保存完了！ 日時：{input_dt_str} で記録しました。（メールは未送信）")
+                        digest_sec = int(digest_min * 60) if use_digest and in_req not in mail_queue.URGENT_REQUESTS else 0
+                        mail_id = send_gmail(my_email, my_pass, t_mail, c_mail, subject, body, digest_sec)
+                        if mail_id:
+                            st.session_state["last_mail_id"] = mail_id
+                        mail_note = "メールは送信キューで順次送信します" if mail_id else "メールは未送信"
+                        if save_state == "saved":
+                            st.success(f"✅ 保存完了！ 日時：{input_dt_str} で登録しました。（{mail_note}）")
+                        elif save_state == "pending":
+                            st.info(f"⏳ 履歴を書き込み中です（日時：{input_dt_str}）。結果はサイドバーに表示します。（{mail_note}）")
+                        else:
+                            st.error(f"⚠️ 履歴の保存に失敗しました（日時：{input_dt_str}）: {save_error}\n入力内容を控えてから、もう一度送信してください。（{mail_note}）")
 
 # --- TAB2: アドレス帳 ---
 with tab2:
-    st.subheader("従業員リスト管理")
-    with st.expander("➕ 新規追加", expanded=True):
-        c1, c2 = st.columns(2)
-        with c1: n_name = st.text_input("名前")
-        with c2: n_mail = st.text_input("メール")
-        if st.button("追加"):
-            if n_name and n_mail:
-                save_employee(n_name, n_mail)
-                st.success("追加しました")
-                st.rerun()
-    st.divider()
-    curr_df = load_employees()
-    if not curr_df.empty:
-        del_target = st.selectbox("削除する従業員を選択", ["---"] + curr_df["名前"].tolist())
-        if st.button("削除実行"):
-            if del_target != "---":
-                delete_employee(del_target)
-                st.warning(f"{del_target} さんを削除しました")
-                st.rerun()
-    st.dataframe(load_employees(), use_container_width=True)
+    if tab2.open:
+        st.subheader("従業員リスト管理")
+        with st.expander("➕ 新規追加", expanded=True):
+            c1, c2 = st.columns(2)
+            with c1: n_name = st.text_input("名前")
+            with c2: n_mail = st.text_input("メール")
+            if st.button("追加"):
+                if n_name and n_mail:
+                    save_employee(n_name, n_mail)
+                    st.success("追加しました")
+                    st.rerun()
+        st.divider()
+        curr_df = load_employees()
+        if not curr_df.empty:
+            emp_labels = employee_directory.labels()
+            del_target = st.selectbox("削除する従業員を選択", [None] + employee_directory.ids(),
+                                      format_func=lambda emp_id: emp_labels.get(emp_id, "---"))
+            if st.button("削除実行"):
+                if del_target is not None:
+                    del_name = employee_directory.labels().get(del_target, "")
+                    delete_employee(del_target)
+                    st.warning(f"{del_name} さんを削除しました")
+                    st.rerun()
+        st.dataframe(curr_df, use_container_width=True, hide_index=True)
 
 # --- TAB3: データ分析 ---
 with tab3:
-    st.subheader("分析レポート")
-    
-    if "ai_keywords_df" not in st.session_state:
-        st.session_state["ai_keywords_df"] = None
-    if "report_text" not in st.session_state:
-        st.session_state["report_text"] = ""
-
-    df = safe_load_history()
+    if tab3.open:
+        st.subheader("履歴検索")
+        search_q = st.text_input("相手・電話番号・メモで検索（空白で区切るとすべてを含むものを検索）", key="search_query", placeholder="例：山田 見積")
+        if search_q.strip():
+            # 月ごとの転置索引で候補を絞ってから確認するので、全履歴を走査しない（処理本体は search_index.py）
+            t0 = time.perf_counter()
+            search_df, search_total = search_index.search(search_q)
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            shown = f"（上位 {len(search_df)} 件を表示）" if search_total > len(search_df) else ""
+            st.caption(f"{search_total} 件ヒット・{elapsed_ms:.0f} ms {shown}")
+            if not search_df.empty:
+                st.dataframe(search_df[history_store.HISTORY_COLUMNS], use_container_width=True, hide_index=True)
+        st.divider()
+
+        st.subheader("分析レポート")
     
-    if len(df) == 0:
-        st.info("データがありません")
-    else:
-        df["datetime"] = pd.to_datetime(df["日時"], errors='coerce')
-        df = df.dropna(subset=["datetime"])
-        df["year"] = df["datetime"].dt.year
-        df["month"] = df["datetime"].dt.month
-        
-        # === フィルター選択部分 ===
-        years = sorted(df["year"].astype(int).unique(), reverse=True)
-        if not years:
-            st.warning("データなし")
+        if "report_text" not in st.session_state:
+            st.session_state["report_text"] = ""
+
+        with st.expander("📥 履歴の書き出し（CSV / JSONL / Excel）"):
+            ex_c1, ex_c2, ex_c3 = st.columns(3)
+            with ex_c1:
+                ex_start = st.date_input("開始日", None, key="export_start")
+            with ex_c2:
+                ex_end = st.date_input("終了日", None, key="export_end")
+            with ex_c3:
+                ex_fmt = st.selectbox("形式", list(export_history.EXPORT_FORMATS), key="export_fmt")
+            ex_reqs = st.multiselect("用件", history_store.rollup_counts("用件").index.tolist(), key="export_reqs")
+            ex_query = st.text_input("相手・電話番号・詳細に含む文字", key="export_query")
+            if st.button("ファイルを作成"):
+                mime, ext = export_history.EXPORT_FORMATS[ex_fmt]
+                # 月ごとに一時ファイルへ書き出し、出来上がったファイルだけを渡す
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    tmp_path = os.path.join(tmp_dir, "history" + ext)
+                    count = export_history.export_history(
+                        tmp_path, ex_fmt,
+                        start=datetime.datetime.combine(ex_start, datetime.time.min) if ex_start else None,
+                        end=datetime.datetime.combine(ex_end, datetime.time.max) if ex_end else None,
+                        requests=ex_reqs, query=ex_query.strip() or None
+                    )
+                    with open(tmp_path, "rb") as f:
+                        export_bytes = f.read()
+                st.caption(f"{count} 件")
+                st.download_button(f"📥 history{ext} 保存", export_bytes, file_name="history" + ext, mime=mime)
+
+        # 月パーティション索引（件数・最小/最大日時）から年・月の選択肢を作る
+        part_index = history_store.partition_index()
+        months_by_year = {}
+        for key, info in part_index.items():
+            m = re.match(r"^(\d{4})-(\d{2})$", key)
+            if m and info["rows"] > 0:
+                months_by_year.setdefault(int(m.group(1)), []).append(int(m.group(2)))
+
+        if sum(info["rows"] for info in part_index.values()) == 0:
+            st.info("データがありません")
         else:
-            c_y, c_m = st.columns(2)
+            # === フィルター選択部分 ===
+            years = sorted(months_by_year, reverse=True)
+            if not years:
+                st.warning("データなし")
+            else:
+                c_y, c_m = st.columns(2)
             
-            # 1. 年の選択
-            year_options = ["---"] + list(years)
-            sel_year = st.selectbox("対象年", year_options)
+                # 1. 年の選択
+                year_options = ["---"] + list(years)
+                sel_year = st.selectbox("対象年", year_options)
             
-            # 2. 月の選択
-            if sel_year == "---":
-                sel_month = "---"
-                st.selectbox("対象月", ["--- (全期間)"], disabled=True)
-            else:
-                months = sorted(df[df["year"] == sel_year]["month"].astype(int).unique())
-                month_options = ["---"] + months
-                sel_month = st.selectbox("対象月", month_options)
-
-            # 3. データの絞り込みとラベル作成
-            if sel_year == "---":
-                df_sub = df
-                period_label = "全期間"
-            elif sel_month == "---":
-                df_sub = df[df["year"] == sel_year]
-                period_label = f"{sel_year}年 年間"
-            else:
-                df_sub = df[(df["year"] == sel_year) & (df["month"] == sel_month)]
-                period_label = f"{sel_year}年 {sel_month}月"
+                # 2. 月の選択
+                if sel_year == "---":
+                    sel_month = "---"
+                    st.selectbox("対象月", ["--- (全期間)"], disabled=True)
+                else:
+                    months = sorted(months_by_year[sel_year])
+                    month_options = ["---"] + months
+                    sel_month = st.selectbox("対象月", month_options)
+
+                # 3. 読み込む月とラベル作成
+                if sel_year == "---":
+                    sel_keys = [f"{y}-{m:02d}" for y in years for m in months_by_year[y]]
+                    period_label = "全期間"
+                elif sel_month == "---":
+                    sel_keys = [f"{sel_year}-{m:02d}" for m in months_by_year[sel_year]]
+                    period_label = f"{sel_year}年 年間"
+                else:
+                    sel_keys = [f"{sel_year}-{sel_month:02d}"]
+                    period_label = f"{sel_year}年 {sel_month}月"
+
+                # 選んだ月のパーティションだけ、分析に使う列だけを読み込む
+                df_sub = safe_load_history(columns=["日時", "相手", "詳細"], partitions=sel_keys)
+                df_sub = df_sub.dropna(subset=["datetime"])
+
+                # 相手先の件数は月別集計を合算（グラフとPDFで共用）
+                caller_series = history_store.rollup_counts("相手", sel_keys)
             
-            # === 結果表示 ===
-            if len(df_sub) > 0:
-                st.success(f"【{period_label}】のデータ: {len(df_sub)}件")
+                # === 結果表示 ===
+                if len(df_sub) > 0:
+                    st.success(f"【{period_label}】のデータ: {len(df_sub)}件")
                 
-                c_left, c_right = st.columns([1, 1])
-                with c_left:
-                    st.markdown("### 📞 相手先TOP10")
-                    caller_counts = df_sub["相手"].value_counts().head(10)
-                    st.bar_chart(caller_counts, horizontal=True)
-                    rank_df = caller_counts.reset_index()
-                    rank_df.columns = ["相手先", "回数"]
-                    st.dataframe(rank_df, use_container_width=True, hide_index=True)
-
-                with c_right:
-                    st.markdown("### 🔑 AIキーワード")
-                    memos = df_sub["詳細"].dropna().astype(str).tolist()
-                    
-                    if groq_key:
-                        if st.button("🤖 AI集計を実行"):
-                            with st.spinner(f"集計中..."):
-                                kw_df = extract_keywords_ai(groq_key, memos)
-                                st.session_state["ai_keywords_df"] = kw_df
-                        
-                        if st.session_state["ai_keywords_df"] is not None:
-                            kw_df = st.session_state["ai_keywords_df"]
+                    c_left, c_right = st.columns([1, 1])
+                    with c_left:
+                        st.markdown("### 📞 相手先TOP10")
+                        caller_counts = caller_series.head(10)
+                        st.bar_chart(caller_counts, horizontal=True)
+                        rank_df = caller_counts.reset_index()
+                        rank_df.columns = ["相手先", "回数"]
+                        st.dataframe(rank_df, use_container_width=True, hide_index=True)
+
+                    with c_right:
+                        st.markdown("### 🔑 頻出キーワード")
+                        kw_df = extract_keywords_local(df_sub["詳細"])
+                        if not kw_df.empty:
                             chart_data = kw_df.set_index("キーワード")
                             st.bar_chart(chart_data["回数"], horizontal=True)
                             st.dataframe(kw_df, use_container_width=True, hide_index=True)
-                    else:
-                        st.warning("APIキー未設定")
-
-                st.divider()
+                        else:
+                            st.info("キーワードが見つかりません")
+
+                    # 曜日×時間帯・担当者別・折り返し依頼の推移（To・用件はカテゴリ型で集計。処理本体は analytics.py）
+                    summary = analytics.summarize(sel_keys)
+                    st.markdown("### 🕒 曜日×時間帯の件数")
+                    st.dataframe(summary["heatmap"], use_container_width=True)
+
+                    c_staff, c_callback = st.columns([1, 1])
+                    with c_staff:
+                        st.markdown("### 👤 担当者別の件数")
+                        staff_df = summary["staff"]
+                        st.bar_chart(staff_df["件数"].head(10), horizontal=True)
+                        st.dataframe(staff_df.reset_index().rename(columns={"To": "担当者"}), use_container_width=True, hide_index=True)
+
+                    with c_callback:
+                        st.markdown("### 🔁 折り返し依頼の推移")
+                        trend_df = summary["callback"]
+                        st.line_chart(trend_df[["全件", "折り返し"]])
+                        st.dataframe(trend_df.reset_index().rename(columns={"datetime": "期間"}), use_container_width=True, hide_index=True)
+
+                    st.divider()
                 
-                st.markdown(f"### ⚡ AI総合レポート ({period_label})")
-                if st.button("🤖 総合レポート生成"):
-                    if groq_key:
-                        with st.spinner(f"執筆中..."):
-                            memos = df_sub["詳細"].dropna().tolist()
-                            report = analyze_with_groq(groq_key, memos, period_label)
-                            st.session_state["report_text"] = report
-                    else:
-                        st.error("APIキー未設定")
+                    st.markdown(f"### ⚡ AI総合レポート ({period_label})")
+                    # 月ごとのメモは、期間を切り替えたときと生成ボタンを押したときだけ作る（検索や出力の再実行では作らない）
+                    # 期間を切り替えたら、同じデータで作成済みのレポートがあればキャッシュから表示
+                    if st.session_state.get("report_period") != period_label:
+                        st.session_state["report_period"] = period_label
+                        st.session_state["report_text"] = ai_analysis.cached_report(ai_analysis.group_memos_by_month(sel_keys), period_label) or ""
+                    if st.button("🤖 総合レポート生成"):
+                        if groq_key:
+                            with st.spinner(f"執筆中..."):
+                                report = analyze_with_groq(groq_key, ai_analysis.group_memos_by_month(sel_keys), period_label)
+                                st.session_state["report_text"] = report
+                        else:
+                            st.error("APIキー未設定")
                 
-                if st.session_state["report_text"]:
-                    if "TOKENが足りません" in st.session_state["report_text"]:
-                         st.markdown(f'<div class="error-box">{st.session_state["report_text"]}</div>', unsafe_allow_html=True)
-                    else:
-                         st.markdown(f'<div class="ai-box">{st.session_state["report_text"]}</div>', unsafe_allow_html=True)
+                    if st.session_state["report_text"]:
+                        if "TOKENが足りません" in st.session_state["report_text"]:
+                             st.markdown(f'<div class="error-box">{st.session_state["report_text"]}</div>', unsafe_allow_html=True)
+                        else:
+                             st.markdown(f'<div class="ai-box">{st.session_state["report_text"]}</div>', unsafe_allow_html=True)
                     
-                    c1, c2 = st.columns(2)
-                    with c1:
-                        st.download_button(
-                            "📄 テキスト保存", 
-                            st.session_state["report_text"], 
-                            file_name=f"report_{period_label.replace(' ', '_')}.txt"
-                        )
-                    with c2:
-                        caller_series = df_sub["相手"].value_counts()
-                        keyword_data = st.session_state.get("ai_keywords_df", None)
-                        
-                        pdf_file = create_pdf_report(
-                            st.session_state["report_text"], 
-                            period_label, 
-                            caller_series, keyword_data
-                        )
-                        st.download_button(
-                            "📄 PDF保存", 
-                            pdf_file, 
-                            file_name=f"report_{period_label.replace(' ', '_')}.pdf", 
-                            mime="application/pdf"
-                        )
-            else:
-                st.warning("この期間のデータはありません")
-
-
-
+                        c1, c2 = st.columns(2)
+                        with c1:
+                            st.download_button(
+                                "📄 テキスト保存", 
+                                st.session_state["report_text"], 
+                                file_name=f"report_{period_label.replace(' ', '_')}.txt"
+                            )
+                        with c2:
+                            # PDFはダウンロードボタンを押したときだけ作成する
+                            report_text = st.session_state["report_text"]
+                            st.download_button(
+                                "📄 PDF保存", 
+                                lambda: create_pdf_report(report_text, period_label, caller_series, kw_df, summary).getvalue(), 
+                                file_name=f"report_{period_label.replace(' ', '_')}.pdf", 
+                                mime="application/pdf"
+                            )
+                else:
+                    st.warning("この期間のデータはありません")
 
+instrumentation.observe("streamlit.rerun", (time.perf_counter() - _rerun_t0) * 1000)
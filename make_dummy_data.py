@@ -1,14 +1,22 @@
-import pandas as pd
-import random
+import argparse
 import datetime
-from openpyxl import Workbook
+import numpy as np
+import pandas as pd
 
 # =====================
 # 設定
 # =====================
+# 使い方:
+#   python make_dummy_data.py                                   600件・5年分を history.xlsx に作成（従来どおり）
+#   python make_dummy_data.py --rows 1000000 --target store     100万件を history_data/ に直接追記
+#   python make_dummy_data.py --rows 100000 --callers 5000 --employees 200 --memos 300 --seed 1
+# 乱数はシード固定。--end で最後の日付も固定すれば、同じ引数なら毎回同じデータになる。
 FILE_NAME = "history.xlsx"
 NUM_RECORDS = 600  # 生成するデータ件数（600件）
 YEARS_RANGE = 5    # 過去何年分作成するか（5年）
+SEED = 42
+CHUNK_ROWS = 500000  # store へ書くときに一度に作る行数（メモリ使用量の上限）
+XLSX_MAX_ROWS = 1048575  # Excel の1シートの上限（見出し行を除く）
 
 # ダミーデータの素材
 EMPLOYEES = [
@@ -42,80 +50,130 @@ MEMOS = [
     "素晴らしい対応ありがとうございましたとお伝えください。"
 ]
 
-def generate_dummy_data():
-    rows = []
-    
-    # 日付計算の基準
-    end_date = datetime.datetime.now()
-    # 5年分の日数（うるう年などは概算）
-    total_days = 365 * YEARS_RANGE 
-    start_date = end_date - datetime.timedelta(days=total_days)
-    
-    print(f"🔄 過去{YEARS_RANGE}年分 ({start_date.strftime('%Y/%m')} ～ Now) のデータを生成中...")
-    print(f"📊 合計 {NUM_RECORDS} 件を作成します...")
-
-    for _ in range(NUM_RECORDS):
-        # 0日後 ～ 5年後(約1825日後) の間でランダムに日時を決定
-        random_days = random.randint(0, total_days)
-        random_minutes = random.randint(0, 60*24)
-        
-        dt = start_date + datetime.timedelta(days=random_days, minutes=random_minutes)
-        dt_str = dt.strftime("%Y/%m/%d %H:%M")
-        
-        # ランダムな担当者選定
-        to_emp = random.choice(EMPLOYEES)
-        from_emp = random.choice(EMPLOYEES)
-        while from_emp == to_emp: # 自分から自分への電話は避ける
-            from_emp = random.choice(EMPLOYEES)
-            
-        client = random.choice(CLIENTS)
-        req = random.choice(REQUESTS)
-        memo = random.choice(MEMOS)
-        
-        # データ行作成
-        row = {
-            "日時": dt_str,
-            "From": from_emp[0],
-            "To": to_emp[0],
-            "CC": "",
-            "相手": client[0],
-            "電話番号": client[1],
-            "用件": req,
-            "詳細": memo,
-            # シート振り分け用のdatetime型（後で削除）
-            "_dt_obj": dt
-        }
-        rows.append(row)
-
-    # DataFrame化
-    df = pd.DataFrame(rows)
-    
-    # 日付順にソート（古い順にしておくとシートが見やすい）
-    df = df.sort_values("_dt_obj")
-    
-    # シート名（年月）列を作成 (例: 2021-03)
-    df["sheet_name"] = df["_dt_obj"].apply(lambda x: x.strftime("%Y-%m"))
-    
-    # 不要な作業用列を削除
-    df_save = df.drop(columns=["_dt_obj"])
-    
-    # Excel書き込み（シート分け）
+# 素材より多く指定されたときに組み合わせて増やすための語彙
+SURNAMES = ["佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤", "吉田", "山田", "松本", "井上", "木村"]
+COMPANY_STEMS = ["ABC", "サクラ", "ミライ", "アオバ", "ヒカリ", "ノース", "ユニオン", "グリーン", "東洋", "日本", "大和", "中央"]
+COMPANY_KINDS = ["株式会社{}", "{}商事", "{}工業", "{}システムズ", "有限会社{}", "{}物流"]
+PRODUCTS = ["アルファ", "ベータ", "ガンマ", "デルタ", "オメガ", "クラウド", "スマート", "ネクスト"]
+PRODUCT_KINDS = ["サーバー", "ライセンス", "プラン", "端末", "保守契約", "カタログ"]
+
+
+def make_vocab(n_callers, n_employees, n_memos):
+    # 既定の素材を先頭に使い、足りない分は語彙を組み合わせて作る
+    employees = EMPLOYEES[:n_employees]
+    for i in range(len(employees), n_employees):
+        name = SURNAMES[i % len(SURNAMES)] + ("さん" if i < len(SURNAMES) else f"{i // len(SURNAMES)}さん")
+        employees.append((name, f"staff{i:05d}@test.com"))
+    clients = CLIENTS[:n_callers]
+    for i in range(len(clients), n_callers):
+        stem = COMPANY_STEMS[i % len(COMPANY_STEMS)]
+        kind = COMPANY_KINDS[(i // len(COMPANY_STEMS)) % len(COMPANY_KINDS)]
+        suffix = "" if i < len(COMPANY_STEMS) * len(COMPANY_KINDS) else str(i // (len(COMPANY_STEMS) * len(COMPANY_KINDS)))
+        clients.append((kind.format(stem + suffix), f"0{3 + i % 7}-{1000 + i // 10000 % 9000:04d}-{i % 10000:04d}"))
+    memos = MEMOS[:n_memos]
+    for i in range(len(memos), n_memos):
+        product = PRODUCTS[i % len(PRODUCTS)] + PRODUCT_KINDS[(i // len(PRODUCTS)) % len(PRODUCT_KINDS)]
+        memos.append(f"{product}の件です。" + MEMOS[i % len(MEMOS)])
+    return employees, clients, memos
+
+
+def generate_frame(n, vocab, rng, end_date=None, years=YEARS_RANGE):
+    # n 件のダミー履歴を日付順の DataFrame で返す（1行ずつのループを使わない）
+    employees, clients, memos = vocab
+    end_date = pd.Timestamp(end_date or datetime.datetime.now()).floor("min")
+    total_minutes = 365 * years * 24 * 60
+    dts = end_date - pd.to_timedelta(rng.integers(0, total_minutes, n), unit="min")
+    to_idx = rng.integers(0, len(employees), n)
+    # 自分から自分への電話は避ける（担当者が1人なら同じになる）
+    from_idx = (to_idx + rng.integers(1, max(len(employees), 2), n)) % len(employees)
+    client_idx = rng.integers(0, len(clients), n)
+    emp_names = np.array([e[0] for e in employees], dtype=object)
+    client_names = np.array([c[0] for c in clients], dtype=object)
+    client_tels = np.array([c[1] for c in clients], dtype=object)
+    df = pd.DataFrame({
+        "日時": dts.strftime("%Y/%m/%d %H:%M"),
+        "From": emp_names[from_idx],
+        "To": emp_names[to_idx],
+        "CC": "",
+        "相手": client_names[client_idx],
+        "電話番号": client_tels[client_idx],
+        "用件": np.array(REQUESTS, dtype=object)[rng.integers(0, len(REQUESTS), n)],
+        "詳細": np.array(memos, dtype=object)[rng.integers(0, len(memos), n)],
+    })
+    order = np.argsort(dts.values, kind="stable")
+    df = df.iloc[order].reset_index(drop=True)
+    df["_key"] = dts.values[order].astype("datetime64[M]").astype(str)  # 例: 2021-03
+    return df
+
+
+def write_xlsx(df, path=FILE_NAME):
+    # 月ごとのシートに書き出す（write_only なので件数が多くてもブック全体をメモリに持たない）
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    columns = [c for c in df.columns if c != "_key"]
+    for key, group in df.groupby("_key", sort=True):
+        ws = wb.create_sheet(title=key)
+        ws.append(columns)
+        for row in group[columns].itertuples(index=False, name=None):
+            ws.append(list(row))
+    wb.save(path)
+
+
+def write_store(df):
+    # history_data/ へ月ごとにまとめて追記（索引・月別集計も更新される）
+    import history_store
+    for key, group in df.groupby("_key", sort=True):
+        history_store.append_rows(key, group.drop(columns=["_key"]).to_dict("records"))
+
+
+def generate_dummy_data(rows=NUM_RECORDS, years=YEARS_RANGE, callers=len(CLIENTS), employees=len(EMPLOYEES),
+                        memos=len(MEMOS), seed=SEED, target="xlsx", path=FILE_NAME, chunk_rows=CHUNK_ROWS, end_date=None):
+    rng = np.random.default_rng(seed)
+    vocab = make_vocab(callers, employees, memos)
+    end_date = end_date or datetime.datetime.now()
+    print(f"🔄 過去{years}年分 ({(end_date - datetime.timedelta(days=365 * years)).strftime('%Y/%m')} ～ Now) のデータを生成中...")
+    print(f"📊 合計 {rows} 件を作成します（相手 {len(vocab[1])} 件 / 従業員 {len(vocab[0])} 人 / メモ {len(vocab[2])} 種類）...")
+
+    if target == "store":
+        done = 0
+        while done < rows:
+            n = min(chunk_rows, rows - done)
+            write_store(generate_frame(n, vocab, rng, end_date, years))
+            done += n
+            print(f"… {done} 件")
+        print("\n🎉 完了！ history_data/ に保存しました。")
+        return
+
+    df = generate_frame(rows, vocab, rng, end_date, years)
+    if df["_key"].value_counts().max() > XLSX_MAX_ROWS:
+        print("\n⚠️ エラー: 1か月あたりの件数が Excel の上限を超えます。--target store を使ってください。")
+        return
     try:
-        with pd.ExcelWriter(FILE_NAME, engine="openpyxl") as writer:
-            # 月（シート名）ごとにグループ化して保存
-            # groupbyのキー順（年月順）にシートが作られます
-            for sheet_name, group_df in df_save.groupby("sheet_name"):
-                # sheet_name列を除外して保存
-                final_df = group_df.drop(columns=["sheet_name"])
-                final_df.to_excel(writer, sheet_name=sheet_name, index=False)
-                # 進捗表示（多すぎるので5件に1回くらい表示でもいいが、今回は全て出す）
-                # print(f"✅ シート作成: {sheet_name} ({len(final_df)}件)")
-            
-        print(f"\n🎉 完了！ '{FILE_NAME}' に5年分のデータを保存しました。")
+        write_xlsx(df, path)
+        print(f"\n🎉 完了！ '{path}' に{years}年分のデータを保存しました。")
         print("アプリ(main.py)を再起動して、分析タブで「年」や「月」を切り替えてみてください。")
-        
+        print("（history_data/ が既にある場合は取り込まれないので、import_history.py で取り込んでください）")
     except PermissionError:
-        print(f"\n⚠️ エラー: '{FILE_NAME}' が開かれています。ファイルを閉じてから再実行してください。")
+        print(f"\n⚠️ エラー: '{path}' が開かれています。ファイルを閉じてから再実行してください。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="動作確認・性能測定用のダミー通話履歴を作成")
+    parser.add_argument("--rows", type=int, default=NUM_RECORDS, help="件数")
+    parser.add_argument("--years", type=int, default=YEARS_RANGE, help="過去何年分か")
+    parser.add_argument("--callers", type=int, default=len(CLIENTS), help="相手先の数")
+    parser.add_argument("--employees", type=int, default=len(EMPLOYEES), help="従業員の数")
+    parser.add_argument("--memos", type=int, default=len(MEMOS), help="詳細メモの種類")
+    parser.add_argument("--seed", type=int, default=SEED, help="乱数シード")
+    parser.add_argument("--end", help="最後の日付 (YYYY-MM-DD、省略時は現在。固定すると毎回同じデータになる)")
+    parser.add_argument("--target", choices=["xlsx", "store"], default="xlsx",
+                        help="xlsx: 月シートの history.xlsx / store: history_data/ へ直接追記")
+    parser.add_argument("--out", default=FILE_NAME, help="xlsx の出力先")
+    args = parser.parse_args()
+    end_date = datetime.datetime.strptime(args.end, "%Y-%m-%d") if args.end else None
+    generate_dummy_data(args.rows, args.years, args.callers, args.employees, args.memos, args.seed,
+                        args.target, args.out, end_date=end_date)
+
 
 if __name__ == "__main__":
-    generate_dummy_data()
\ No newline at end of file
+    main()
@@ -0,0 +1,151 @@
+import io
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import instrumentation
+
+# =====================
+# PDFレポート設定
+# =====================
+# reportlab（PDF生成用ライブラリ）は最初にPDFを作るときに読み込む（入力タブだけ使う場合は読み込まない）
+FONT_NAME = "HeiseiKakuGo-W5"
+PDF_CACHE_SIZE = 16  # 直近に作ったPDFをこの件数だけメモリに保持
+
+_setup_lock = threading.Lock()
+_resources = None
+_cache_lock = threading.Lock()
+_pdf_cache = OrderedDict()
+
+
+def _get_resources():
+    # reportlab の読み込み・フォント登録・スタイル作成はプロセスで1回だけ
+    global _resources
+    with _setup_lock:
+        if _resources is None:
+            from reportlab.pdfbase import pdfmetrics
+            from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+            from reportlab.lib.styles import getSampleStyleSheet
+            from reportlab.platypus import TableStyle
+            from reportlab.lib import colors
+            pdfmetrics.registerFont(UnicodeCIDFont(FONT_NAME))
+            styles = getSampleStyleSheet()
+            style_jp = styles["Normal"]
+            style_jp.fontName = FONT_NAME
+            style_jp.fontSize = 10
+            style_jp.leading = 14
+            style_title = styles["Title"]
+            style_title.fontName = FONT_NAME
+            style_h2 = styles["Heading2"]
+            style_h2.fontName = FONT_NAME
+            table_style = TableStyle([
+                ('FONT', (0,0), (-1,-1), FONT_NAME),
+                ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+                ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
+                ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+            ])
+            _resources = (style_jp, style_title, style_h2, table_style)
+    return _resources
+
+
+def _build(report_text, period_label, ranking, keywords, heatmap, staff):
+    style_jp, style_title, style_h2, table_style = _get_resources()
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+
+    story = []
+    story.append(Paragraph(f"電話対応分析レポート ({period_label})", style_title))
+    story.append(Spacer(1, 10*mm))
+    story.append(Paragraph("【AI分析サマリー】", style_h2))
+
+    if "TOKENが足りません" in report_text:
+        story.append(Paragraph(report_text, style_jp))
+    else:
+        for line in report_text.split('\n'):
+            if line.strip() == "": story.append(Spacer(1, 2*mm))
+            else: story.append(Paragraph(line, style_jp))
+
+    story.append(Spacer(1, 10*mm))
+
+    if ranking:
+        story.append(Paragraph("【相手先件数（TOP10）】", style_h2))
+        story.append(Spacer(1, 3*mm))
+        table_data = [['順位', '相手先名', '件数']]
+        for idx, (name, count) in enumerate(ranking, 1):
+            table_data.append([str(idx), str(name), str(count)])
+        t = Table(table_data, colWidths=[20*mm, 90*mm, 30*mm])
+        t.setStyle(table_style)
+        story.append(t)
+        story.append(Spacer(1, 10*mm))
+
+    if keywords:
+        story.append(Paragraph("【頻出キーワード】", style_h2))
+        story.append(Spacer(1, 3*mm))
+        table_data_kw = [['キーワード', '回数']]
+        for word, count in keywords:
+            table_data_kw.append([str(word), str(count)])
+        t_kw = Table(table_data_kw, colWidths=[90*mm, 30*mm])
+        t_kw.setStyle(table_style)
+        story.append(t_kw)
+        story.append(Spacer(1, 10*mm))
+
+    if heatmap:
+        story.append(Paragraph("【曜日×時間帯の件数】", style_h2))
+        story.append(Spacer(1, 3*mm))
+        t_hm = Table(heatmap, colWidths=[15*mm] + [19*mm] * (len(heatmap[0]) - 1))
+        t_hm.setStyle(table_style)
+        story.append(t_hm)
+        story.append(Spacer(1, 10*mm))
+
+    if staff:
+        story.append(Paragraph("【担当者別件数（TOP10）】", style_h2))
+        story.append(Spacer(1, 3*mm))
+        table_data_staff = [['担当者', '件数', '折り返し依頼', '割合']]
+        for name, count, callbacks, share in staff:
+            table_data_staff.append([str(name), str(count), str(callbacks), f"{share:.1%}"])
+        t_staff = Table(table_data_staff, colWidths=[60*mm, 25*mm, 30*mm, 25*mm])
+        t_staff.setStyle(table_style)
+        story.append(t_staff)
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def _summary_tables(summary):
+    # analytics.summarize() の結果から、PDF に載せる表（曜日×3時間帯、担当者TOP10）を作る
+    if not summary or not summary.get("rows"):
+        return [], []
+    import analytics
+    hm = analytics.heatmap_by_hour_bins(summary["heatmap"])
+    heatmap = [["曜日"] + list(hm.columns)] + [[str(day)] + [str(int(v)) for v in row] for day, row in zip(hm.index, hm.values.tolist())]
+    staff = [(str(name), int(r["件数"]), int(r["折り返し"]), float(r["割合"])) for name, r in summary["staff"].head(10).iterrows()]
+    return heatmap, staff
+
+
+def render_pdf(report_text, period_label, caller_df, keyword_df, summary=None):
+    # (レポート本文, 期間, ランキング, キーワード, 時系列の集計) が同じなら作成済みのPDFを返す
+    ranking = [] if caller_df is None or caller_df.empty else [(str(k), int(v)) for k, v in caller_df.head(10).items()]
+    keywords = [] if keyword_df is None or keyword_df.empty else [(str(r[0]), str(r[1])) for r in keyword_df.iloc[:, :2].values.tolist()]
+    heatmap, staff = _summary_tables(summary)
+    key = hashlib.sha256(json.dumps([report_text, period_label, ranking, keywords, heatmap, staff], ensure_ascii=False).encode("utf-8")).hexdigest()
+    with _cache_lock:
+        if key in _pdf_cache:
+            _pdf_cache.move_to_end(key)
+            instrumentation.add("pdf.cache_hits")
+            return _pdf_cache[key]
+    with instrumentation.timed("pdf.render"):
+        pdf_bytes = _build(report_text, period_label, ranking, keywords, heatmap, staff)
+    instrumentation.add("pdf.bytes", len(pdf_bytes))
+    with _cache_lock:
+        _pdf_cache[key] = pdf_bytes
+        while len(_pdf_cache) > PDF_CACHE_SIZE:
+            _pdf_cache.popitem(last=False)
+    return pdf_bytes
+
+
+def create_pdf_report(report_text, period_label, caller_df, keyword_df, summary=None):
+    return io.BytesIO(render_pdf(report_text, period_label, caller_df, keyword_df, summary))
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+# =====================
+# AI応答キャッシュ（セッション・プロセス間で共有）
+# =====================
+# キー: (関数名, モデル, プロンプト版数, 対象期間, メモ全体のハッシュ)
+# 件数が MAX_ENTRIES を超えたら、最後に使われたのが古いものから削除（LRU）
+# 月別サマリーは別テーブル（月ごとに1件、LRU の対象外）。複数プロセスから同時に書いても SQLite が直列化する
+CACHE_FILE = os.path.join("cache", "ai_cache.sqlite3")
+MAX_ENTRIES = 500
+
+
+def _connect():
+    os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+    conn = sqlite3.connect(CACHE_FILE, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS cache ("
+        " key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS month_summaries ("
+        " month TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)"
+    )
+    return conn
+
+
+def memo_hash(memo_list):
+    h = hashlib.sha256()
+    for memo in memo_list:
+        h.update(str(memo).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def make_key(func, model, version, period_label, memo_list):
+    raw = json.dumps([func, model, version, period_label, memo_hash(memo_list)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get(key):
+    # 見つからなければ None。キャッシュが壊れていても分析は続けられるように例外は握りつぶす
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (time.time(), key))
+                return json.loads(row[0])
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError, ValueError):
+        return None
+
+
+def put(key, value):
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, last_access) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), time.time())
+                )
+                conn.execute(
+                    "DELETE FROM cache WHERE key NOT IN"
+                    " (SELECT key FROM cache ORDER BY last_access DESC LIMIT ?)", (MAX_ENTRIES,)
+                )
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError):
+        pass
+
+
+def get_month_summary(month):
+    # {"hash", "version", "summary"}。無ければ None
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute("SELECT value FROM month_summaries WHERE month = ?", (month,)).fetchone()
+            return None if row is None else json.loads(row[0])
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError, ValueError):
+        return None
+
+
+def put_month_summary(month, entry):
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO month_summaries (month, value, updated) VALUES (?, ?, ?)",
+                    (month, json.dumps(entry, ensure_ascii=False), time.time())
+                )
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError):
+        pass
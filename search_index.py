@@ -0,0 +1,207 @@
+import os
+import re
+import json
+import unicodedata
+import numpy as np
+import pandas as pd
+
+import history_store
+import write_queue
+import instrumentation
+from history_store import HISTORY_COLUMNS
+
+# =====================
+# 全文検索索引（history_data/search/YYYY-MM.npz）
+# =====================
+# 相手・詳細は文字 2-gram、電話番号は数字だけにした 2-gram で転置索引を作る。
+# 月ごとに「gram -> 行番号（ファイル内の位置）」を CSR 形式（grams, offsets, data）で保存し、
+# save_history の追記分は差分ファイル（YYYY-MM.delta.jsonl）に追記し、検索時に月の索引と合わせて使う
+# （差分・書き戻し・作り直しは history_store.DeltaIndex）。
+# 索引で候補行を絞ってから、その行だけを部分一致で確認して順位を付ける。
+SEARCH_DIR = os.path.join(history_store.STORE_DIR, "search")
+PHONE_PREFIX = "\t"  # 電話番号の gram の印（本文側は空白を除くので重ならない）
+FIELD_WEIGHTS = {"相手": 3, "電話番号": 3, "詳細": 1}
+DEFAULT_LIMIT = 100
+COMPACT_EVERY = 500  # 差分ファイルの行数がこれに達したら月の索引に書き戻す
+
+
+def _by_category(s, func):
+    # カテゴリ型の列は辞書だけを変換して行へ展開する（欠損は ""）
+    # 検索の候補行のように辞書より行が少ないときは、行をそのまま変換したほうが速い
+    if not isinstance(s.dtype, pd.CategoricalDtype):
+        return func(s)
+    if len(s) < len(s.cat.categories):
+        return func(s.astype("object"))
+    cats = func(pd.Series(s.cat.categories, dtype="object")).to_numpy(dtype=object)
+    return pd.Series(np.append(cats, "")[s.cat.codes.to_numpy()], index=s.index, dtype="object").astype(str)
+
+
+def _norm_text(s):
+    # 全角・半角や大文字・小文字の違いを吸収し、空白を除く
+    return _by_category(s, lambda v: v.fillna("").astype(str).str.normalize("NFKC").str.lower().str.replace(r"\s+", "", regex=True))
+
+
+def _norm_phone(df):
+    # 読み込み時に作った数字だけの列があればそれを使う（追記した行の dict から作った DataFrame には無い）
+    if "phone_digits" in df.columns:
+        return _by_category(df["phone_digits"], lambda v: v.fillna(""))
+    return df["電話番号"].fillna("").astype(str).str.normalize("NFKC").str.replace(r"\D", "", regex=True)
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _query_phone(term):
+    # 数字と - ( ) + だけの語は電話番号としても探す
+    return re.sub(r"\D", "", term) if re.fullmatch(r"[\d\-()+]+", term) else ""
+
+
+def _postings(df, base=0):
+    # {gram: 行番号の配列}。同じ内容の行は1回だけ分解する
+    keys = _norm_text(df["相手"]) + "\x00" + _norm_text(df["詳細"]) + "\x00" + _norm_phone(df)
+    codes, uniques = pd.factorize(keys)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    by_gram = {}
+    for u, text in enumerate(uniques):
+        caller, memo, phone = text.split("\x00")
+        grams = _bigrams(caller) | _bigrams(memo) | {PHONE_PREFIX + g for g in _bigrams(phone)}
+        for g in grams:
+            by_gram.setdefault(g, []).append(u)
+    return {g: np.sort(np.concatenate([order[bounds[u]:bounds[u + 1]] for u in us])).astype(np.int32) + base
+            for g, us in by_gram.items()}
+
+
+def _pack(rows, postings):
+    grams = sorted(postings)
+    sizes = [len(postings[g]) for g in grams]
+    offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]).astype(np.int64)
+    data = np.concatenate([postings[g] for g in grams]).astype(np.int32) if grams else np.zeros(0, np.int32)
+    index = {g: (int(offsets[i]), int(offsets[i + 1])) for i, g in enumerate(grams)}
+    return {"rows": rows, "index": index, "data": data, "extra": {}}
+
+
+def _unpack(ent):
+    # 月の索引と差分を合わせた {gram: 行番号の配列}
+    postings = {g: ent["data"][s:e] for g, (s, e) in ent["index"].items()}
+    for g, rows in ent["extra"].items():
+        postings[g] = np.concatenate([postings[g], rows]) if g in postings else rows
+    return postings
+
+
+def _read(path):
+    with np.load(path, allow_pickle=False) as z:
+        meta = json.loads(str(z["meta"]))
+        grams, offsets = z["grams"].tolist(), z["offsets"]
+        index = {g: (int(offsets[i]), int(offsets[i + 1])) for i, g in enumerate(grams)}
+        return {"fp": meta["fp"], "rows": meta["rows"], "index": index, "data": z["data"], "extra": {}}
+
+
+def _write(path, ent):
+    # 差分を月の索引にまとめて保存する
+    packed = _pack(ent["rows"], _unpack(ent))
+    grams = sorted(packed["index"], key=lambda g: packed["index"][g][0])
+    offsets = [0] + [packed["index"][g][1] for g in grams]
+    with write_queue.atomic_write(path, "wb") as f:
+        np.savez(f, grams=np.array(grams, dtype=str), offsets=np.array(offsets, dtype=np.int64),
+                 data=packed["data"], meta=np.array(json.dumps({"fp": ent["fp"], "rows": packed["rows"]})))
+    return packed
+
+
+def _build(df):
+    return _pack(len(df), _postings(df))
+
+
+def _make_delta(rows):
+    # 追記した行の gram（行番号は追記した行の中での位置）
+    postings = _postings(pd.DataFrame(rows, columns=HISTORY_COLUMNS))
+    return {"n": len(rows), "grams": {g: v.tolist() for g, v in postings.items()}}
+
+
+def _apply(ent, delta):
+    # 差分の行番号を、足す前の行数だけずらして足す
+    for g, rows in delta["grams"].items():
+        new = np.asarray(rows, dtype=np.int32) + ent["rows"]
+        ent["extra"][g] = np.concatenate([ent["extra"][g], new]) if g in ent["extra"] else new
+    ent["rows"] += delta["n"]
+
+
+# 月の索引: {"fp", "delta", "rows", "index": {gram: (start, end)}, "data", "extra": {gram: 差分の行番号}}
+INDEX = history_store.DeltaIndex(SEARCH_DIR, ".npz", None, lambda: _pack(0, {}), _read, _write, _build,
+                                 _make_delta, _apply, compact_every=COMPACT_EVERY)
+history_store.register_append_hook(INDEX.on_append)
+
+
+def _hits(ent, g):
+    # 月の索引と差分の行番号（差分の行は月の索引の行より後ろなので、つなげても昇順のまま）
+    span = ent["index"].get(g)
+    hit = ent["data"][span[0]:span[1]] if span is not None else None
+    extra = ent["extra"].get(g)
+    if extra is not None:
+        hit = extra if hit is None else np.concatenate([hit, extra])
+    return hit
+
+
+def _candidates(ent, grams):
+    # すべての gram を含む行番号（gram が1つも無ければ None = 絞り込みなし）
+    rows = None
+    hits = {g: _hits(ent, g) for g in grams}
+    for g in sorted(grams, key=lambda g: 0 if hits[g] is None else len(hits[g])):
+        hit = hits[g]
+        if hit is None:
+            return np.zeros(0, np.int32)
+        rows = hit if rows is None else np.intersect1d(rows, hit, assume_unique=True)
+        if len(rows) == 0:
+            break
+    return rows
+
+
+@instrumentation.timed("search.query")
+def search(query, partitions=None, limit=DEFAULT_LIMIT):
+    # 相手・電話番号・詳細から query（空白区切りはすべてを含む）を探す
+    # 戻り値: (上位 limit 件の DataFrame（score・datetime 列つき。スコアの高い順→新しい順）, ヒット総数)
+    terms = unicodedata.normalize("NFKC", str(query)).lower().split()
+    empty = pd.DataFrame(columns=HISTORY_COLUMNS + ["datetime", "score"])
+    if not terms:
+        return empty, 0
+    phones = [_query_phone(t) for t in terms]
+    keys = history_store.get_store().partitions()
+    if partitions is not None:
+        keys = [k for k in keys if k in set(partitions)]
+
+    hits = []
+    for key in keys:
+        ent = INDEX.entry(key)
+        cand = None
+        for term, digits in zip(terms, phones):
+            text_c = _candidates(ent, _bigrams(term)) if len(term) >= 2 else None
+            phone_c = _candidates(ent, {PHONE_PREFIX + g for g in _bigrams(digits)}) if len(digits) >= 2 else None
+            if text_c is None and phone_c is None:
+                continue  # 1文字だけの語は索引では絞らず、下の確認で判定
+            term_c = text_c if phone_c is None else phone_c if text_c is None else np.union1d(text_c, phone_c)
+            cand = term_c if cand is None else np.intersect1d(cand, term_c, assume_unique=True)
+        if cand is not None and len(cand) == 0:
+            continue
+        _, df = history_store.load_partition(key)
+        sub = df if cand is None else df.iloc[cand[cand < len(df)]]
+        if sub.empty:
+            continue
+        caller, memo, phone = _norm_text(sub["相手"]), _norm_text(sub["詳細"]), _norm_phone(sub)
+        matched = pd.Series(True, index=sub.index)
+        score = pd.Series(0, index=sub.index)
+        for term, digits in zip(terms, phones):
+            in_caller = caller.str.contains(term, regex=False)
+            in_memo = memo.str.contains(term, regex=False)
+            in_phone = phone.str.contains(digits, regex=False) if digits else pd.Series(False, index=sub.index)
+            matched &= in_caller | in_memo | in_phone
+            score += (in_caller * FIELD_WEIGHTS["相手"] + in_memo * FIELD_WEIGHTS["詳細"]
+                      + in_phone * FIELD_WEIGHTS["電話番号"])
+        if matched.any():
+            hits.append(sub[matched].assign(score=score[matched]))
+
+    if not hits:
+        return empty, 0
+    result = pd.concat(hits, ignore_index=True)
+    result = result.sort_values(["score", "datetime"], ascending=[False, False], kind="stable", na_position="last")
+    return result.head(limit).reset_index(drop=True), len(result)
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+
+# =====================
+# 設定
+# =====================
+# 使い方:
+#   python stress_test.py                                  4プロセス × 50スレッド × 5件を同時に save_history
+#   python stress_test.py --processes 8 --threads 100      件数を増やす
+#   python stress_test.py --keep                           確認後も作業フォルダを残す（場所を表示）
+# 空の作業フォルダで、複数プロセス・複数スレッドから同時に書き込み、
+# 件数・重複・月別索引（_index.json）・月別集計（rollups/）が実際のファイルと一致するかを確かめる。
+# 検索索引（search/）と相手先の集計（callers/）は、書き込み中にも検索して差分の書き戻しを何度も起こし、
+# 最後に「ベース＋差分ファイル」が元データにつながるか、作り直した索引と検索結果が同じかを確かめる。
+# 一致しなければ終了コード 1。
+PROCESSES = 4
+THREADS = 50
+WRITES = 5
+MONTHS = ["2025-01", "2025-02", "2025-03"]  # 書き込みを振り分ける月（月をまたいだ同時追記も試す）
+COMPACT_EVERY = 20   # 書き込み側の差分の書き戻し間隔（通常より短くして書き戻しを何度も起こす）
+QUERY_EVERY = 2      # 各スレッドが何件書くごとに検索するか
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_worker(proc_id, threads, writes):
+    # カレントフォルダの history_data/ へ threads 本のスレッドから同時に書き込む
+    import history_store
+    import write_queue
+    import search_index
+    import caller_lookup
+    search_index.INDEX.compact_every = caller_lookup.INDEX.compact_every = COMPACT_EVERY
+
+    futures, futures_lock = [], threading.Lock()
+    start = threading.Event()
+
+    def fire(thread_id):
+        start.wait()
+        for i in range(writes):
+            month = MONTHS[(thread_id + i) % len(MONTHS)]
+            f = history_store.save_history(
+                f"{month.replace('-', '/')}/15 {thread_id % 24:02d}:{i % 60:02d}", "受付", f"担当{proc_id}", "",
+                f"相手{thread_id % 7}", "03-0000-0000", "伝言のみ", f"{proc_id}-{thread_id}-{i}")
+            with futures_lock:
+                futures.append(f)
+            if i % QUERY_EVERY == 0:
+                search_index.search(f"相手{thread_id % 7}")
+                caller_lookup.lookup("相手")
+
+    workers = [threading.Thread(target=fire, args=(t,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    start.set()
+    for w in workers:
+        w.join()
+    errors = 0
+    for f in futures:
+        try:
+            f.result(timeout=120)
+        except Exception as e:
+            errors += 1
+            print(f"⚠️ 書き込みエラー: {e}", file=sys.stderr)
+    write_queue.flush()
+    return {"submitted": len(futures), "errors": errors}
+
+
+def verify(expected_memos):
+    # 元データ（jsonl）を直接読んで、件数・重複と派生ファイルを突き合わせる
+    import history_store
+    store = history_store.get_store()
+    problems = []
+    memos = Counter()
+    index = history_store._read_index()
+    for key in store.partitions():
+        df = store.read(key)
+        memos.update(df["詳細"].astype(str))
+        fp = list(store.fingerprint(key))
+        ent = index.get(key)
+        if ent is None:
+            problems.append(f"{key}: _index.json に月がありません")
+        elif ent["fp"] != fp or ent["rows"] != len(df):
+            problems.append(f"{key}: _index.json が不一致（{ent['rows']} 件 / 実際 {len(df)} 件）")
+        rollup = history_store._read_json(history_store._rollup_path(key))
+        if not rollup or rollup.get("fp") != fp:
+            problems.append(f"{key}: 月別集計の指紋が不一致")
+            continue
+        for c in history_store.ROLLUP_FIELDS:
+            actual = {str(k): int(v) for k, v in df[c].dropna().astype(str).value_counts().items()}
+            if rollup["counts"][c] != actual:
+                problems.append(f"{key}: 月別集計（{c}）が不一致")
+    missing = set(expected_memos) - set(memos)
+    duplicated = [m for m, n in memos.items() if n > 1]
+    if missing:
+        problems.append(f"書き込まれていない行: {len(missing)} 件")
+    if duplicated:
+        problems.append(f"重複した行: {len(duplicated)} 件")
+    return sum(memos.values()), problems + verify_delta_indexes(store)
+
+
+def _answers(queries):
+    import search_index
+    import caller_lookup
+    found = {}
+    for q in queries:
+        df, total = search_index.search(q, limit=10 ** 6)
+        found[("search", q)] = (total, sorted(df["詳細"].astype(str)))
+        found[("lookup", q)] = caller_lookup.lookup(q, limit=10 ** 6)
+    return found
+
+
+def verify_delta_indexes(store):
+    # 書き込み中に作られた「ベース＋差分ファイル」が元データの指紋までつながるか、
+    # それで検索した結果が索引を消して作り直したときと同じかを確かめる
+    import search_index
+    import caller_lookup
+    problems = []
+    for name, idx in (("検索索引", search_index.INDEX), ("相手先の集計", caller_lookup.INDEX)):
+        for key in store.partitions():
+            if idx._load(key)["fp"] != list(store.fingerprint(key)):
+                problems.append(f"{key}: {name}の差分が元データにつながりません")
+    queries = [f"相手{n}" for n in range(7)] + ["相手", "伝言", "03-0000", "担当0"]
+    before = _answers(queries)
+    for idx in (search_index.INDEX, caller_lookup.INDEX):
+        shutil.rmtree(idx.directory, ignore_errors=True)
+        idx.clear()
+    caller_lookup._merged = {"sig": None}
+    after = _answers(queries)
+    for k in queries:
+        if before[("search", k)] != after[("search", k)]:
+            problems.append(f"検索「{k}」: 差分から {before[('search', k)][0]} 件 / 作り直し {after[('search', k)][0]} 件")
+        if before[("lookup", k)] != after[("lookup", k)]:
+            problems.append(f"相手先「{k}」: 差分からの結果が作り直しと一致しません")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数プロセス・スレッドから同時に save_history して整合性を確認")
+    parser.add_argument("--processes", type=int, default=PROCESSES, help="プロセス数")
+    parser.add_argument("--threads", type=int, default=THREADS, help="1プロセスあたりのスレッド数")
+    parser.add_argument("--writes", type=int, default=WRITES, help="1スレッドあたりの書き込み数")
+    parser.add_argument("--keep", action="store_true", help="作業フォルダを残す")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)  # 内部用: 子プロセスとして書き込む
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        json.dump(run_worker(args.worker, args.threads, args.writes), sys.stdout)
+        return
+
+    total = args.processes * args.threads * args.writes
+    print(f"⏱️ {args.processes} プロセス × {args.threads} スレッド × {args.writes} 件 = {total} 件を同時に書き込み中...")
+    work_dir = tempfile.mkdtemp(prefix="call_stress_")
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, HISTORY_BACKEND="jsonl")
+    try:
+        t0 = time.perf_counter()
+        procs = [
+            subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "stress_test.py"), "--worker", str(p),
+                              "--threads", str(args.threads), "--writes", str(args.writes)],
+                             cwd=work_dir, stdout=subprocess.PIPE, text=True, env=env)
+            for p in range(args.processes)
+        ]
+        results = [json.loads(p.communicate()[0] or "{}") for p in procs]
+        elapsed = time.perf_counter() - t0
+        if any(p.returncode != 0 for p in procs):
+            print("⚠️ エラー: 書き込み用のプロセスが異常終了しました")
+            sys.exit(2)
+        errors = sum(r.get("errors", 0) for r in results)
+        print(f"  書き込み {sum(r.get('submitted', 0) for r in results)} 件 / エラー {errors} 件 / {elapsed:.1f} 秒")
+
+        os.environ["HISTORY_BACKEND"] = "jsonl"
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        sys.path.insert(0, REPO_DIR)
+        try:
+            expected = [f"{p}-{t}-{i}" for p in range(args.processes) for t in range(args.threads) for i in range(args.writes)]
+            rows, problems = verify(expected)
+        finally:
+            os.chdir(cwd)
+    finally:
+        if args.keep:
+            print(f"  作業フォルダ: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"  保存された行: {rows} 件（期待 {total} 件）")
+    for p in problems:
+        print(f"⚠️ {p}")
+    if problems or errors or rows != total:
+        sys.exit(1)
+    print("✅ 件数・索引・月別集計・検索索引・相手先の集計はすべて一致しました")
+
+
+if __name__ == "__main__":
+    main()
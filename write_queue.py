@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+import instrumentation
+
+# =====================
+# 書き込みキュー設定
+# =====================
+# 画面からの保存はキューに積んですぐ戻り、書き込みはこのプロセスの専用スレッド1本が順番に行う。
+# 複数プロセス（複数の Streamlit サーバーや取り込みCLI）の間はロックファイルで直列化する。
+# 同じ merge_key の書き込みが溜まっていれば、まとめて1回で書き込む。
+MAX_ATTEMPTS = 5
+RETRY_BASE_SEC = 0.5     # 0.5, 1, 2, 4 秒後に再試行
+FLUSH_TIMEOUT_SEC = 30   # 終了時に未書き込み分を待つ上限
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+_queue = queue.Queue()
+_lock = threading.Lock()
+_worker = None
+
+
+@contextmanager
+def file_lock(path):
+    # プロセス間の排他ロック（取れるまで待つ）
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def atomic_write(path, mode="w", **kwargs):
+    # 一時ファイルに書き切ってから置き換えるので、読み手が書きかけのファイルを見ることはない
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def submit(func, items, merge_key=None):
+    # func(items) を書き込みスレッドで実行する。戻り値の Future で完了・失敗がわかる
+    # merge_key が同じ待ち行列は func(items1 + items2 + ...) の1回にまとめる
+    future = Future()
+    _queue.put((merge_key, func, list(items), future, time.perf_counter()))
+    _ensure_worker()
+    return future
+
+
+def pending():
+    return _queue.qsize()
+
+
+def flush(timeout=FLUSH_TIMEOUT_SEC):
+    # キューが空になるまで待つ（CLIの終了時など）
+    deadline = time.time() + timeout
+    while _queue.unfinished_tasks and time.time() < deadline:
+        time.sleep(0.05)
+    return _queue.unfinished_tasks == 0
+
+
+def _drain(first):
+    # 先頭の1件と、その時点で溜まっている分を merge_key ごとにまとめる
+    batches, by_key = [], {}
+    task = first
+    while task is not None:
+        merge_key = task[0]
+        if merge_key is not None and merge_key in by_key:
+            by_key[merge_key].append(task)
+        else:
+            batches.append([task])
+            if merge_key is not None: by_key[merge_key] = batches[-1]
+        try:
+            task = _queue.get_nowait()
+        except queue.Empty:
+            task = None
+    return batches
+
+
+def _execute(batch):
+    func = batch[0][1]
+    items = [item for task in batch for item in task[2]]
+    result, error = None, None
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            result, error = func(items), None
+            break
+        except OSError as e:
+            # 一時的なI/Oエラー（ファイルを他のアプリが開いている等）は少し待ってやり直す
+            # （func は OSError を投げるとき何も書いていない状態に戻しておくこと。
+            #   戻せないときは OSError 以外を投げて再試行させない）
+            error = e
+            time.sleep(RETRY_BASE_SEC * (2 ** attempt))
+        except Exception as e:
+            error = e
+            break
+    if error is not None:
+        print(f"⚠️ 書き込みエラー（{len(items)} 件）: {error}", file=sys.stderr)
+        instrumentation.add("write_queue.errors")
+    done = time.perf_counter()
+    instrumentation.add("write_queue.batches")
+    instrumentation.add("write_queue.items", len(items))
+    for task in batch:
+        instrumentation.observe("write_queue.latency", (done - task[4]) * 1000)  # 積んでから書き終わるまで
+        if error is not None: task[3].set_exception(error)
+        else: task[3].set_result(result)
+        _queue.task_done()
+
+
+def _run():
+    while True:
+        for batch in _drain(_queue.get()):
+            _execute(batch)
+
+
+def _ensure_worker():
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="write-queue", daemon=True)
+            _worker.start()
+
+
+atexit.register(flush)